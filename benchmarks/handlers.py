@@ -0,0 +1,338 @@
+"""Бенчмарк обработчиков бота на локальной PostgreSQL.
+
+Настоящие обработчики из Черновик.py вызываются с синтетическими Update, бот подменен
+записывающей заглушкой Bot API. Для каждого обработчика выводятся задержки p50/p95/p99
+и среднее число обращений к базе и к Bot API на вызов.
+
+    BENCH_DSN=postgresql://postgres:1@localhost/bench python benchmarks/handlers.py --contests 10000 --history 200000
+
+База из BENCH_DSN заполняется заново при каждом запуске (схемы contests, history и bot_state
+удаляются), поэтому бенчмарк запускается только на базе, в имени которой есть bench, test или
+scratch, либо с флагом --i-know-this-drops-data.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, timedelta
+from itertools import count
+from math import ceil
+
+from telegram import Bot, Update
+from telegram.ext import Application, CallbackContext
+from telegram.request import BaseRequest
+
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+bot_module = importlib.import_module("Черновик")
+
+BENCH_USER_ID = 100
+BENCH_CHAT_ID = 100
+HANDLERS = ("show_contests", "update_contests_page", "handle_input", "transfer_to_main_db")
+# Подстроки имени базы, по которым она считается одноразовой
+SCRATCH_DB_MARKERS = ("bench", "test", "scratch")
+
+# Исходные таблицы бота в первоначальном виде (даты строками ДД.ММ.ГГГГ); остальное
+# доводят миграции бота при создании пула
+BASE_SCHEMA = """
+    CREATE SCHEMA IF NOT EXISTS contests;
+    CREATE SCHEMA IF NOT EXISTS history;
+    CREATE TABLE IF NOT EXISTS contests.contests (link text, date text, dop_channels text, status text);
+    CREATE TABLE IF NOT EXISTS contests.pending_contests (link text, date text, dop_channels text);
+    CREATE TABLE IF NOT EXISTS contests.tracked_contests (user_id bigint, link text, date text);
+    CREATE TABLE IF NOT EXISTS history.history (id bigserial, link text, user_id bigint);
+"""
+
+
+# Заглушка Bot API: запоминает вызванные методы и отвечает правдоподобными объектами
+class RecordingRequest(BaseRequest):
+    def __init__(self):
+        self.calls = []
+        self._message_ids = count(1000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append(endpoint)
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if endpoint in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", BENCH_CHAT_ID), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+# Заполнение базы синтетическими конкурсами, историей участия и ожидающими конкурсами
+async def seed_database(dsn, contests, history, pending, allow_drop=False):
+    conn = await asyncpg.connect(dsn)
+    try:
+        database = await conn.fetchval("SELECT current_database()")
+        if not allow_drop and not any(marker in database.lower() for marker in SCRATCH_DB_MARKERS):
+            raise SystemExit(
+                f"База {database!r} не похожа на тестовую: бенчмарк удаляет схемы contests, history и bot_state. "
+                f"Используйте базу с bench, test или scratch в имени или флаг --i-know-this-drops-data"
+            )
+
+        # Схемы создаются заново, чтобы каждый запуск проходил все миграции бота
+        await conn.execute("DROP SCHEMA IF EXISTS contests, history, bot_state CASCADE")
+        await conn.execute(BASE_SCHEMA)
+
+        today = date.today()
+        links = [f"https://t.me/bench_channel_{i}/{i}" for i in range(contests)]
+        completed = max(contests // 10, 1)
+        await conn.copy_records_to_table(
+            "contests.contests",
+            columns=["link", "date", "dop_channels", "status"],
+            records=[
+                (
+                    link,
+                    (today if i < completed else today + timedelta(days=i % 60)).strftime("%d.%m.%Y"),
+                    "@bench_extra",
+                    "Завершен" if i < completed else "Активен",
+                )
+                for i, link in enumerate(links)
+            ],
+        )
+        if links and history:
+            await conn.copy_records_to_table(
+                "history.history",
+                columns=["link", "user_id"],
+                records=[(links[i % len(links)], i) for i in range(history)],
+            )
+        await conn.copy_records_to_table(
+            "contests.pending_contests",
+            columns=["link", "date", "dop_channels"],
+            records=[
+                (f"https://t.me/bench_pending_{i}/{i}", today.strftime("%d.%m.%Y"), None)
+                for i in range(pending)
+            ],
+        )
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+    return links
+
+
+# Подсчет обращений к базе через подмену функций модуля, которыми пользуются обработчики
+def install_db_counter(counters):
+    execute_query = bot_module.execute_query
+    fetch_prepared = bot_module.fetch_prepared
+
+    async def counted_execute_query(*args, **kwargs):
+        counters["db"] += 1
+        return await execute_query(*args, **kwargs)
+
+    async def counted_fetch_prepared(*args, **kwargs):
+        counters["db"] += 1
+        return await fetch_prepared(*args, **kwargs)
+
+    bot_module.execute_query = counted_execute_query
+    bot_module.fetch_prepared = counted_fetch_prepared
+
+
+class Bench:
+    def __init__(self, application, request, links, user_id):
+        self.application = application
+        self.request = request
+        self.links = links
+        self.user_id = user_id
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+
+    def _user(self):
+        return {"id": self.user_id, "is_bot": False, "first_name": "bench"}
+
+    def _message(self, text=None, message_id=None):
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": BENCH_CHAT_ID, "type": "private"},
+            "from": self._user(),
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    def message_update(self, text):
+        return Update.de_json(
+            {"update_id": next(self._update_ids), "message": self._message(text)},
+            self.application.bot,
+        )
+
+    def callback_update(self, data, message_id=1):
+        return Update.de_json(
+            {
+                "update_id": next(self._update_ids),
+                "callback_query": {
+                    "id": str(next(self._update_ids)),
+                    "from": self._user(),
+                    "chat_instance": "bench",
+                    "data": data,
+                    "message": self._message("", message_id),
+                },
+            },
+            self.application.bot,
+        )
+
+    def context(self, update):
+        return CallbackContext.from_update(update, self.application)
+
+
+# Сценарии: подготовка вне замера, возвращается корутина для замера
+async def prepare_show_contests(bench, i):
+    update = bench.message_update("Показать все конкурсы")
+    return bot_module.show_contests(update, bench.context(update))
+
+
+async def prepare_update_contests_page(bench, i):
+    total_pages = max(ceil(len(bench.links) / bot_module.CONTESTS_PER_PAGE), 1)
+    page = i % total_pages + 1
+    update = bench.callback_update(f"page_Активен_{page}")
+    return bot_module.update_contests_page(update, bench.context(update), page, "Активен")
+
+
+async def prepare_handle_input(bench, i):
+    link = bench.links[i % len(bench.links)] if bench.links else "https://t.me/bench_missing/1"
+    update = bench.message_update(link)
+    return bot_module.handle_input(update, bench.context(update))
+
+
+async def prepare_transfer_to_main_db(bench, i):
+    rows = await bot_module.execute_query(
+        "INSERT INTO contests.pending_contests (link, link_key, date) VALUES ($1, $1, $2) RETURNING id",
+        (f"https://t.me/bench_transfer/{i}", date.today()),
+    )
+    update = bench.callback_update(bot_module.encode_callback("pnd_mv", rows[0]["id"]))
+    return bot_module.transfer_to_main_db(update, bench.context(update))
+
+
+SCENARIOS = {
+    "show_contests": prepare_show_contests,
+    "update_contests_page": prepare_update_contests_page,
+    "handle_input": prepare_handle_input,
+    "transfer_to_main_db": prepare_transfer_to_main_db,
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(ceil(fraction * len(ordered)) - 1, len(ordered) - 1)]
+
+
+async def run_scenario(bench, name, iterations, warmup, cold, counters):
+    latencies = []
+    db_calls = 0
+    api_calls = 0
+    for i in range(warmup + iterations):
+        if cold:
+            bot_module.invalidate_contests_cache()
+        call = await SCENARIOS[name](bench, i)
+        db_before, api_before = counters["db"], len(bench.request.calls)
+        started = time.perf_counter()
+        await call
+        elapsed = time.perf_counter() - started
+        # Удаления сообщений выполняет фоновая очистка, в бенчмарке она не запущена
+        bot_module.pending_deletions.clear()
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            db_calls += counters["db"] - db_before
+            api_calls += len(bench.request.calls) - api_before
+    return {
+        "handler": name,
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "db_per_call": db_calls / iterations,
+        "api_per_call": api_calls / iterations,
+    }
+
+
+def print_results(results):
+    print(f"{'handler':<22} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'db/call':>8} {'api/call':>9}")
+    for r in results:
+        print(
+            f"{r['handler']:<22} {r['iterations']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+            f"{r['p99_ms']:>9.2f} {r['db_per_call']:>8.2f} {r['api_per_call']:>9.2f}"
+        )
+
+
+async def run(args):
+    links = await seed_database(args.dsn, args.contests, args.history, args.pending, args.i_know_this_drops_data)
+    bot_module.DB_PARAMS.clear()
+    bot_module.DB_PARAMS["dsn"] = args.dsn
+    bot_module.DB_REPLICA_PARAMS[:] = [{"dsn": dsn} for dsn in args.replica_dsn]
+    counters = {"db": 0}
+    install_db_counter(counters)
+
+    request = RecordingRequest()
+    bot = Bot("123:bench", request=request, get_updates_request=RecordingRequest())
+    application = Application.builder().bot(bot).updater(None).build()
+    await application.initialize()
+    await bot_module.get_db_pool()
+
+    user_id = bot_module.ADMIN_USERS[0] if bot_module.ADMIN_USERS else BENCH_USER_ID
+    bench = Bench(application, request, links, user_id)
+    try:
+        results = [
+            await run_scenario(bench, name, args.iterations, args.warmup, args.cold, counters)
+            for name in args.handlers
+        ]
+    finally:
+        await application.shutdown()
+        await bot_module.close_db_pool()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args) | {"dsn": None, "replica_dsn": None}, "results": results}, f, indent=2, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков бота")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN"), help="строка подключения к тестовой базе (по умолчанию BENCH_DSN)")
+    parser.add_argument("--replica-dsn", action="append", default=[],
+                        help="строка подключения к реплике BENCH_DSN (можно указать несколько раз)")
+    parser.add_argument("--contests", type=int, default=1000, help="число конкурсов в contests.contests")
+    parser.add_argument("--history", type=int, default=10000, help="число строк в history.history")
+    parser.add_argument("--pending", type=int, default=20, help="число ожидающих конкурсов")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--cold", action="store_true", help="сбрасывать кэш списков конкурсов перед каждым вызовом")
+    parser.add_argument("--handlers", nargs="+", choices=HANDLERS, default=list(HANDLERS))
+    parser.add_argument("--i-know-this-drops-data", action="store_true",
+                        help="разрешить запуск на базе, имя которой не помечает ее как тестовую")
+    parser.add_argument("--json", help="сохранить результаты в JSON для сравнения между запусками")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("укажите --dsn или переменную окружения BENCH_DSN")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,41 @@
+import argparse
+import contextvars
+import csv
+import functools
+import hashlib
+import hmac
+import html
+import inspect
+import io
+import json
 import logging
+import random
+import secrets
+import signal
 from math import ceil
 import datetime
 import telegram
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram import ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, filters, ContextTypes
+from telegram.ext import TypeHandler
+from telegram.ext import BasePersistence, BaseRateLimiter, BaseUpdateProcessor, PersistenceInput
+from telegram.error import RetryAfter
 import psycopg2
 import asyncio
 import asyncpg
 from psycopg2 import sql
 from psycopg2.extras import DictCursor
 from telegram.constants import ParseMode
+from aiohttp import web
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 import re
-from datetime import date, datetime
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
 
 # Включение логирования
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -30,9 +53,341 @@ DB_PARAMS = {
     "port": "5432"
 }
 
+# Реплики только для чтения, ключи как в DB_PARAMS. Пустой список - все запросы идут на основной сервер
+DB_REPLICA_PARAMS = [
+    # {"database": "Telegram", "user": "postgres", "password": "1", "host": "localhost", "port": "5433"},
+]
+
+# Параметры маршрутизации чтения между основным сервером и репликами
+REPLICA_PARAMS = {
+    # Секунд после записи, в течение которых чтения того же пользователя (и списков
+    # конкурсов после их изменения) идут на основной сервер, а не на отстающую реплику
+    "read_your_writes_window": 5,
+}
+
+# Параметры пула соединений asyncpg
+POOL_PARAMS = {
+    "min_size": 2,
+    "max_size": 10,
+    "connect_timeout": 10,  # секунд на установку нового соединения
+    "acquire_timeout": 5,  # секунд ожидания свободного соединения из пула
+    "command_timeout": 30,
+    "max_inactive_connection_lifetime": 300,
+    "statement_cache_size": 256,  # подготовленных запросов на соединение (кэш asyncpg)
+}
+
+# Общий пул соединений процесса, создается в post_init или при первом обращении
+db_pool = None
+db_pool_lock = asyncio.Lock()
+
+# Пулы реплик (создаются вместе с основным) и счетчик для их чередования
+replica_pools = []
+replica_counter = 0
+
+# Пользователь, чье обновление сейчас обрабатывается (задается в PerUserUpdateProcessor)
+current_user_id = contextvars.ContextVar("current_user_id", default=None)
+
+# Пользователи, недавно писавшие в базу: {user_id: time.monotonic() окончания окна}
+recent_writers = OrderedDict()
+
+# Реестр именованных запросов горячего пути. Запросы выполняются через кэш подготовленных
+# запросов asyncpg (statement_cache_size): на каждом соединении пула запрос готовится один раз
+# и дальше переиспользуется без повторного разбора и планирования
+PREPARED_STATEMENTS = {
+    "link_exists": "SELECT EXISTS(SELECT 1 FROM contests.contests WHERE link_key = $1) AS exists",
+    "tracked_contests": """
+        SELECT id, link, date FROM contests.tracked_contests
+        WHERE user_id = $1
+        ORDER BY id
+    """,
+    "pending_contests": "SELECT id, link, date FROM contests.pending_contests ORDER BY id",
+}
+
+# Количество конкурсов на одной странице списка
+CONTESTS_PER_PAGE = 5
+
+# Нижняя граница списка активных конкурсов: начало месяца, отстоящего на столько месяцев назад.
+# None - показываются все активные, включая давно прошедшие, которые администратору нужно завершить.
+# С числом планировщик отсекает старые месячные разделы, а в заголовке списка указывается граница
+ACTIVE_LOOKBACK_MONTHS = None
+
+# Фильтры списка конкурсов по статусу: (суффикс имени запроса, условие WHERE, число параметров)
+CONTEST_LIST_FILTERS = {
+    'Активен': ("active", "c.status = $1", 1) if ACTIVE_LOOKBACK_MONTHS is None
+               else ("active", "c.status = $1 AND c.date >= $2", 2),
+    'Завершен': ("completed", "c.status = $1 AND c.date = $2", 2),
+}
+
+CONTEST_PAGE_QUERY = """
+    SELECT c.link, c.date, c.status,
+           COALESCE(pc.participant_count, 0) as participant_count
+    FROM contests.contests c
+    LEFT JOIN contests.participant_counts pc ON pc.link = c.link
+    WHERE {where}
+    ORDER BY c.date {order}, c.link {order}
+    LIMIT {limit}
+"""
+
+# Запросы страниц списка: подсчет, переход по номеру (OFFSET) и keyset-переходы по (date, link)
+def get_contest_page_statements():
+    statements = {}
+    for name, where, count in CONTEST_LIST_FILTERS.values():
+        a, b, c = (f"${count + i}" for i in range(1, 4))
+        statements[f"contests_count_{name}"] = f"SELECT COUNT(*) FROM contests.contests c WHERE {where}"
+        statements[f"contests_page_{name}"] = CONTEST_PAGE_QUERY.format(
+            where=where, order="ASC", limit=f"{a} OFFSET {b}")
+        statements[f"contests_after_{name}"] = CONTEST_PAGE_QUERY.format(
+            where=f"{where} AND (c.date, c.link) > ({a}, {b})", order="ASC", limit=c)
+        statements[f"contests_from_{name}"] = CONTEST_PAGE_QUERY.format(
+            where=f"{where} AND (c.date, c.link) >= ({a}, {b})", order="ASC", limit=c)
+        statements[f"contests_before_{name}"] = CONTEST_PAGE_QUERY.format(
+            where=f"{where} AND (c.date, c.link) < ({a}, {b})", order="DESC", limit=c)
+    return statements
+
+PREPARED_STATEMENTS.update(get_contest_page_statements())
+
+# Выражение поиска по ссылке и доп. каналам; совпадает с выражением триграммного индекса
+SEARCH_EXPRESSION = "(c.link || ' ' || coalesce(c.dop_channels::text, ''))"
+
+PREPARED_STATEMENTS.update({
+    "search_count": f"SELECT COUNT(*) FROM contests.contests c WHERE {SEARCH_EXPRESSION} ILIKE $1",
+    "search_page": f"""
+        SELECT c.link, c.date, c.status,
+               COALESCE(pc.participant_count, 0) as participant_count
+        FROM contests.contests c
+        LEFT JOIN contests.participant_counts pc ON pc.link = c.link
+        WHERE {SEARCH_EXPRESSION} ILIKE $1
+        ORDER BY c.date DESC, c.link
+        LIMIT $2 OFFSET $3
+    """,
+})
+
+# Параметры режима webhook. Если webhook_url не задан, setWebhook не вызывается:
+# так сервер можно проверять локально, отправляя записанные обновления POST-запросом
+# на http://listen:port/url_path с заголовком X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_PARAMS = {
+    "listen": "127.0.0.1",
+    "port": 8443,
+    "url_path": "telegram",
+    "webhook_url": None,  # например "https://example.com/telegram"
+    # Секрет заголовка X-Telegram-Bot-Api-Secret-Token (символы A-Z, a-z, 0-9, _ и -). Если не задан,
+    # при webhook_url генерируется случайный, иначе бот не запустится
+    "secret_token": None,
+    "max_connections": 40,
+}
+
+# Параметры параллельной обработки обновлений
+CONCURRENCY_PARAMS = {
+    "max_concurrent_updates": 32,  # одновременно выполняемых обработчиков
+    "max_queued_updates": 1024,  # обновлений в работе, включая ждущие своей очереди у пользователя
+}
+
+# Параметры хранения состояния бота в базе данных
+PERSISTENCE_PARAMS = {
+    "flush_interval": 10,  # секунд между пакетными записями изменений (update_interval приложения)
+    "retry_delay": 10,  # секунд до повторной записи после ошибки
+}
+
+# Параметры хранения user_data в памяти
+USER_DATA_PARAMS = {
+    "idle_ttl": 7 * 24 * 3600,  # секунд без активности, после которых user_data удаляется
+    "eviction_interval": 3600,  # секунд между проверками
+}
+
+# Параметры исходящих запросов к Bot API (ограничения Telegram на частоту сообщений)
+OUTBOUND_PARAMS = {
+    "global_rate": 30,  # запросов в секунду на всего бота
+    "global_burst": 30,
+    "private_chat_rate": 1,  # запросов в секунду в личный чат
+    "private_chat_burst": 3,
+    "group_chat_rate": 20 / 60,  # запросов в секунду в группу
+    "group_chat_burst": 5,
+    "max_retries": 3,  # повторов после ответа 429 (retry_after)
+    "max_chat_buckets": 10000,
+}
+
+# Параметры напоминаний об отслеживаемых конкурсах
+REMINDER_PARAMS = {
+    "hour": 10,  # час (по часовому поясу timezone), в который приходит напоминание в день конкурса
+    "timezone": "Europe/Moscow",  # часовой пояс дат конкурсов, одинаковый для бота и SQL
+    "retry_delay": 60,  # секунд до повторной попытки, если запланировать рассылку не удалось
+    "batch_size": 500,  # строк, забираемых одним запросом
+    "send_chunk": 30,  # сообщений, отправляемых одновременно (темп задает OutboundRateLimiter)
+    "job_name": "tracked_contest_reminders",
+}
+
+# Параметры массовой загрузки конкурсов из файла
+IMPORT_PARAMS = {
+    "max_file_size": 5 * 1024 * 1024,
+    "max_reported_errors": 10,
+    "encodings": ("utf-8-sig", "cp1251"),  # кодировки файла в порядке проверки (Excel сохраняет CSV в cp1251)
+}
+
+# Параметры фоновой очистки служебных сообщений
+CLEANUP_PARAMS = {
+    "max_sleep": 300,  # секунд ожидания без новых удалений, прежде чем проверить базу
+    "coalesce_delay": 1,  # секунд ожидания после пробуждения, чтобы собрать удаления в одну пачку
+    "retry_delay": 10,  # секунд до повторного прохода после ошибки
+    "batch_size": 1000,  # строк из базы за один проход
+    "chunk_size": 100,  # сообщений в одном вызове deleteMessages (ограничение Telegram)
+}
+
+# Параметры месячных разделов contests.contests
+PARTITION_PARAMS = {
+    "months_ahead": 3,  # сколько будущих месяцев держать созданными заранее
+    "maintenance_interval": 24 * 60 * 60,  # секунд между проверками разделов
+    # Разделы старше стольких месяцев отсоединяются (DETACH) и остаются отдельными
+    # таблицами для архивации; None - не отсоединять автоматически
+    "detach_after_months": None,
+}
+
+# Параметры поиска конкурсов (триграммный индекс работает с запросами от 3 символов)
+SEARCH_PARAMS = {
+    "min_length": 3,
+    "max_length": 100,
+}
+
+# Параметры кэша списков конкурсов
+CACHE_PARAMS = {
+    "contests_ttl": 30,  # секунд жизни закэшированной страницы/счетчика
+    "contests_maxsize": 512,
+    # Результаты поиска держатся отдельно, чтобы разовые запросы не вытесняли страницы списков
+    "search_ttl": 30,
+    "search_maxsize": 128,
+}
+
+# Параметры HTTP-эндпоинта метрик в формате Prometheus
+METRICS_PARAMS = {
+    "host": "127.0.0.1",
+    "port": 9108,
+}
+
+# Параметры журнала медленных запросов и выборочных планов запросов
+QUERY_LOG_PARAMS = {
+    "slow_threshold": 0.2,  # секунд; запросы дольше попадают в журнал медленных запросов
+    "explain_sample_rate": 0.01,  # доля выполнений, для которых снимается EXPLAIN ANALYZE
+    # Запросы, для которых снимаются планы: списки конкурсов и отслеживаемые конкурсы
+    "explain_prefixes": ("contests_count_", "contests_page_", "contests_after_", "contests_from_",
+                         "contests_before_", "tracked_contests"),
+}
+
 # Список администраторов
 ADMIN_USERS = [1]  # Замените на реальные ID администраторов
 
+# Метрики бота, отдаются на METRICS_PARAMS["port"] по пути /metrics
+HANDLER_LATENCY = Histogram("bot_handler_latency_seconds", "Время работы обработчика", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ["handler"])
+QUERY_LATENCY = Histogram("bot_db_query_latency_seconds", "Время выполнения запроса к базе", ["statement"])
+QUERY_ERRORS = Counter("bot_db_query_errors_total", "Ошибки запросов к базе", ["statement"])
+STATEMENT_CACHE = Counter(
+    "bot_db_statement_cache_total", "Обращения к кэшу подготовленных запросов соединения", ["statement", "result"]
+)
+DB_POOL_SIZE = Gauge("bot_db_pool_size", "Открытые соединения пула")
+DB_POOL_IDLE = Gauge("bot_db_pool_idle", "Свободные соединения пула")
+API_CALLS = Counter("bot_api_calls_total", "Запросы к Bot API", ["endpoint"])
+API_RETRY_AFTER = Counter("bot_api_retry_after_total", "Ответы 429 (RetryAfter) от Bot API", ["endpoint"])
+API_COALESCED_EDITS = Counter("bot_api_coalesced_edits_total", "Правки, объединенные с более новыми")
+CACHE_REQUESTS = Counter("bot_cache_requests_total", "Обращения к кэшам списков и поиска", ["cache", "result"])
+CONVERSATION_STATES = Gauge("bot_conversation_states", "Число разговоров в каждом состоянии", ["conversation", "state"])
+
+# Имена состояний разговора для меток метрик
+CONVERSATION_STATE_NAMES = {
+    INIT: "INIT", WAITING_INPUT: "WAITING_INPUT", ADDITIONAL_CHANNELS: "ADDITIONAL_CHANNELS",
+    CHANNELS_INPUT: "CHANNELS_INPUT", CONFIRMATION: "CONFIRMATION", FINISH_CONTEST: "FINISH_CONTEST",
+    WAITING_FOR_TRACKED_DATE: "WAITING_FOR_TRACKED_DATE",
+    WAITING_FOR_PENDING_DOP_CHANNELS: "WAITING_FOR_PENDING_DOP_CHANNELS", START: "START",
+    AWAITING_DATE: "AWAITING_DATE", END: "END", WAITING_FOR_PENDING_DATE: "WAITING_FOR_PENDING_DATE",
+}
+
+
+# Функция для обертки обработчика: время работы и исключения по имени функции
+def instrument_callback(callback):
+    handler_name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            result = callback(update, context)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception:
+            HANDLER_ERRORS.labels(handler_name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(handler_name).observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+# Функция для обертки всех зарегистрированных обработчиков, включая вложенные в ConversationHandler
+def instrument_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            handler.callback = instrument_callback(handler.callback)
+
+
+# Отдельные журналы, чтобы их можно было направить в свои файлы
+slow_query_logger = logging.getLogger("slow_queries")
+query_plan_logger = logging.getLogger("query_plans")
+
+# Незавершенные фоновые задачи EXPLAIN ANALYZE (храним ссылки, чтобы задачи не собрал GC)
+explain_tasks = set()
+
+
+# Контекст для замера запроса к базе: метрики, ошибки и журнал медленных запросов
+@asynccontextmanager
+async def observe_query(name, params=None):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        QUERY_ERRORS.labels(name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        QUERY_LATENCY.labels(name).observe(elapsed)
+        if elapsed >= QUERY_LOG_PARAMS["slow_threshold"]:
+            slow_query_logger.warning(f"Slow query {name}: {elapsed * 1000:.1f} ms, params={params}")
+
+
+# Функция для выборочного снятия плана именованного запроса в фоне, не задерживая обработчик
+def maybe_explain_query(name, params):
+    if not name.startswith(QUERY_LOG_PARAMS["explain_prefixes"]):
+        return
+    if random.random() >= QUERY_LOG_PARAMS["explain_sample_rate"]:
+        return
+    task = asyncio.create_task(explain_query(name, params))
+    explain_tasks.add(task)
+    task.add_done_callback(explain_tasks.discard)
+
+
+async def explain_query(name, params):
+    try:
+        _, pool = await get_read_pool()
+        async with pool.acquire(timeout=POOL_PARAMS["acquire_timeout"]) as conn:
+            rows = await conn.fetch(
+                f"EXPLAIN (ANALYZE, BUFFERS) {PREPARED_STATEMENTS[name]}", *params
+            )
+        plan = "\n".join(row[0] for row in rows)
+        query_plan_logger.info(f"Plan for {name} with params={params}:\n{plan}")
+    except Exception as e:
+        logging.error(f"Error explaining query {name}: {e}")
+
+
+# Функция для учета перехода разговора из одного состояния в другое (None - нет разговора)
+def record_conversation_state(name, old_state, new_state):
+    if old_state is not None:
+        CONVERSATION_STATES.labels(name, CONVERSATION_STATE_NAMES.get(old_state, str(old_state))).dec()
+    if new_state is not None:
+        CONVERSATION_STATES.labels(name, CONVERSATION_STATE_NAMES.get(new_state, str(new_state))).inc()
+
 async def error_handler(update, context):
     """Log the error and send a telegram message to notify the developer."""
     # Log the error before we do anything else, so we can see it even if something breaks.
@@ -55,31 +410,1082 @@ async def error_handler(update, context):
     # Finally, send the message
     await context.bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.HTML)
 
+# Шаблоны ссылок, компилируются один раз при загрузке модуля
+URL_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+BARE_TELEGRAM_LINK_PATTERN = re.compile(r'(?:www\.)?(?:t|telegram)\.me/\S+', re.IGNORECASE)
+SCHEME_PATTERN = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://')
+DATE_PATTERN = re.compile(r'^\d{2}\.\d{2}$')
+TELEGRAM_HOSTS = {'t.me', 'telegram.me'}
+# Параметры ссылок t.me, которые несут полезную нагрузку (реферальные коды ботов) и входят в ключ
+TELEGRAM_PAYLOAD_PARAMS = ('start', 'startgroup', 'startapp')
+
+
 # Функция для проверки, является ли текст ссылкой
 def is_url(text):
-    url_pattern = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
-    return bool(url_pattern.match(text))
+    text = text.strip()
+    return bool(URL_PATTERN.match(text) or BARE_TELEGRAM_LINK_PATTERN.fullmatch(text))
+
+
+# Функция для подготовки введенной ссылки к сохранению: без пробелов по краям и со схемой.
+# В поле link хранится и показывается именно она, канонический вид идет только в link_key
+def prepare_link(link):
+    link = link.strip()
+    if not SCHEME_PATTERN.match(link):
+        link = f"https://{link}"
+    return link
+
+
+# Функция для приведения ссылки t.me к каноническому пути: имена каналов и ботов
+# регистронезависимы, а хэши приглашений (+hash, joinchat/hash) - нет
+def canonicalize_telegram_path(path):
+    segments = path.lstrip('/').split('/')
+    if segments[0].lower() == 'joinchat':
+        return '/' + '/'.join(['joinchat'] + segments[1:])
+    if segments[0].startswith('+'):
+        return '/' + '/'.join(segments)
+    return '/' + '/'.join(segment.lower() for segment in segments)
+
+
+# Функция для приведения ссылки к каноническому виду: https, хост в нижнем регистре
+# без www, telegram.me -> t.me, без фрагмента и завершающего "/". У ссылок t.me
+# остаются только параметры с полезной нагрузкой (?start=...), а остальные (?single,
+# ?comment=...) отбрасываются. Канонический вид используется только как ключ поиска link_key
+def canonicalize_link(link):
+    parts = urlsplit(prepare_link(link))
+
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/')
+
+    if host in TELEGRAM_HOSTS:
+        payload = [(key, value) for key, value in parse_qsl(parts.query) if key in TELEGRAM_PAYLOAD_PARAMS]
+        query = f"?{urlencode(payload)}" if payload else ""
+        return f"https://t.me{canonicalize_telegram_path(path) if path else ''}{query}"
+    query = f"?{parts.query}" if parts.query else ""
+    return f"https://{host}{path}{query}"
 
 
 # Функция для проверки, является ли текст датой
 def is_date(text):
-    date_pattern = re.compile(r'^\d{2}\.\d{2}$')
-    return bool(date_pattern.match(text))
+    return bool(DATE_PATTERN.match(text))
+
+# Ограничение Telegram на размер callback_data в байтах
+CALLBACK_DATA_LIMIT = 64
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+# Функция для записи неотрицательного числа в base36
+def to_base36(number):
+    digits = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = BASE36_DIGITS[remainder] + digits
+        if not number:
+            return digits
+
+
+# Функция для упаковки действия и идентификаторов строк в callback_data: "action:id1,id2"
+def encode_callback(action, *ids):
+    data = f"{action}:{','.join(to_base36(row_id) for row_id in ids)}"
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data longer than {CALLBACK_DATA_LIMIT} bytes: {data}")
+    return data
+
+
+# Функция для разбора callback_data, упакованных encode_callback: (action, [id, ...])
+def decode_callback(data):
+    action, _, payload = data.partition(':')
+    return action, [int(row_id, 36) for row_id in payload.split(',') if row_id]
+
 
 async def check_admin_status(user_id, context):
     if 'is_admin' not in context.user_data:
         context.user_data['is_admin'] = user_id in ADMIN_USERS
     return context.user_data['is_admin']
 
-# Функция для получения соединения с базой данных через asyncpg
-async def get_asyncpg_connection():
-    return await asyncpg.connect(
-        database=DB_PARAMS["database"],
-        user=DB_PARAMS["user"],
-        password=DB_PARAMS["password"],
-        host=DB_PARAMS["host"],
-        port=DB_PARAMS["port"]
+# Кэш с временем жизни записей. Одновременные промахи по одному ключу
+# объединяются в одну загрузку (и считаются попаданием), invalidate() сбрасывает
+# все записи и увеличивает версию данных. Попадания и промахи идут в CACHE_REQUESTS
+class TTLCache:
+    def __init__(self, name, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.version = 0
+        self._hits = CACHE_REQUESTS.labels(name, "hit")
+        self._misses = CACHE_REQUESTS.labels(name, "miss")
+        self._data = OrderedDict()
+        self._loading = {}
+
+    async def get_or_load(self, key, loader):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._hits.inc()
+            self._data.move_to_end(key)
+            return entry[1]
+
+        loading_key = (self.version, key)
+        task = self._loading.get(loading_key)
+        if task is None:
+            self._misses.inc()
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._loading[loading_key] = task
+        else:
+            self._hits.inc()
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        version = self.version
+        try:
+            value = await loader()
+            # Результат, загруженный до инвалидации, в кэш не попадает
+            if version == self.version:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            return value
+        finally:
+            self._loading.pop((version, key), None)
+
+    def invalidate(self):
+        self.version += 1
+        self._data.clear()
+
+
+# Общий кэш страниц и счетчиков списков конкурсов
+contests_cache = TTLCache("contests", CACHE_PARAMS["contests_ttl"], CACHE_PARAMS["contests_maxsize"])
+search_cache = TTLCache("search", CACHE_PARAMS["search_ttl"], CACHE_PARAMS["search_maxsize"])
+
+
+# Время последнего изменения конкурсов (time.monotonic()): в течение окна read-your-writes
+# списки читаются с основного сервера, чтобы в общий кэш не попали данные отстающей реплики
+contests_written_at = float("-inf")
+
+
+# Функция для сброса кэша списков после изменения конкурсов
+def invalidate_contests_cache():
+    global contests_written_at
+    contests_written_at = time.monotonic()
+    contests_cache.invalidate()
+    search_cache.invalidate()
+
+
+def contests_recently_written():
+    return time.monotonic() - contests_written_at < REPLICA_PARAMS["read_your_writes_window"]
+
+
+# Обработчик очереди обновлений: разные пользователи обрабатываются параллельно,
+# обновления одного пользователя в одном чате - строго по порядку, чтобы переходы
+# состояний ConversationHandler применялись в той же последовательности
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates, max_queued_updates):
+        # Семафор базового класса ограничивает число обновлений в работе, собственный -
+        # число выполняемых обработчиков. Ждущие своей очереди обновления одного
+        # пользователя не занимают слоты выполнения
+        super().__init__(max_queued_updates)
+        self._running = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}
+
+    @staticmethod
+    def get_update_key(update):
+        if not isinstance(update, Update):
+            return None
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        user_id = update.effective_user.id if update.effective_user else None
+        if chat_id is None and user_id is None:
+            return None
+        return chat_id, user_id
+
+    async def do_process_update(self, update, coroutine):
+        key = self.get_update_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        # Обработка идет в отдельной задаче на каждое обновление, значение не выходит за ее пределы
+        current_user_id.set(key[1])
+
+        # Запись: [блокировка, число ожидающих]; удаляется, когда у ключа не осталось обновлений
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# Ведро токенов: не более rate запросов в секунду с запасом capacity на всплески
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+# Очередь исходящих запросов к Bot API: общий лимит и лимит на чат, повтор после 429.
+# Повторные правки одного сообщения, ждущие своей очереди, объединяются: уходит только
+# последняя, а все ожидающие получают ее результат
+class OutboundRateLimiter(BaseRateLimiter):
+    def __init__(self, params):
+        self.params = params
+        self._global_bucket = TokenBucket(params["global_rate"], params["global_burst"])
+        self._chat_buckets = OrderedDict()
+        self._pending_edits = {}
+        self.api_calls = 0
+        self.retry_after_count = 0
+        self.coalesced_edits = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _get_chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.params["group_chat_rate"], self.params["group_chat_burst"])
+            else:
+                bucket = TokenBucket(self.params["private_chat_rate"], self.params["private_chat_burst"])
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > self.params["max_chat_buckets"]:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id):
+        await self._get_chat_bucket(chat_id).acquire()
+        await self._global_bucket.acquire()
+
+    async def _call(self, chat_id, endpoint, callback, args, kwargs):
+        for attempt in range(self.params["max_retries"] + 1):
+            self.api_calls += 1
+            API_CALLS.labels(endpoint).inc()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                API_RETRY_AFTER.labels(endpoint).inc()
+                if attempt == self.params["max_retries"]:
+                    raise
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood limit hit for chat {chat_id}, retrying in {retry_after}s")
+                self._get_chat_bucket(chat_id).pause(retry_after)
+                await self._acquire(chat_id)
+
+    async def _process_edit(self, chat_id, message_id, callback, args, kwargs):
+        key = (chat_id, message_id)
+        entry = self._pending_edits.get(key)
+        if entry is not None:
+            # Правка еще не отправлена: подменяем ее содержимое на более новое
+            entry["call"] = (callback, args, kwargs)
+            self.coalesced_edits += 1
+            API_COALESCED_EDITS.inc()
+            return await asyncio.shield(entry["future"])
+
+        future = asyncio.get_running_loop().create_future()
+        entry = {"call": (callback, args, kwargs), "future": future}
+        self._pending_edits[key] = entry
+        try:
+            await self._acquire(chat_id)
+        except BaseException:
+            del self._pending_edits[key]
+            future.cancel()
+            raise
+        # Токен получен, запрос уходит: следующие правки ждут уже новой очереди
+        del self._pending_edits[key]
+
+        callback, args, kwargs = entry["call"]
+        try:
+            result = await self._call(chat_id, "editMessageText", callback, args, kwargs)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        future.set_result(result)
+        return result
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        # Запросы без чата (getUpdates, answerCallbackQuery и т.п.) не ограничиваются
+        if chat_id is None:
+            API_CALLS.labels(endpoint).inc()
+            return await callback(*args, **kwargs)
+
+        # Любая правка или удаление делает сохраненный отпечаток сообщения недействительным
+        if endpoint.startswith("editMessage") or endpoint == "deleteMessage":
+            forget_message_fingerprint(chat_id, data.get("message_id"))
+        elif endpoint == "deleteMessages":
+            for message_id in data.get("message_ids", []):
+                forget_message_fingerprint(chat_id, message_id)
+
+        if endpoint == "editMessageText" and data.get("message_id"):
+            return await self._process_edit(chat_id, data["message_id"], callback, args, kwargs)
+
+        await self._acquire(chat_id)
+        return await self._call(chat_id, endpoint, callback, args, kwargs)
+
+
+# Функция для получения пула соединений (создается при первом обращении вместе с подготовкой схемы).
+# Первой к базе может обратиться persistence при инициализации приложения, еще до post_init
+async def get_db_pool():
+    global db_pool
+    if db_pool is None:
+        async with db_pool_lock:
+            if db_pool is None:
+                pool = await create_db_pool("primary", DB_PARAMS)
+                await run_migrations(pool)
+                replica_pools[:] = await create_replica_pools()
+                db_pool = pool
+                DB_POOL_SIZE.set_function(pool.get_size)
+                DB_POOL_IDLE.set_function(pool.get_idle_size)
+    return db_pool
+
+# Функция для создания пула соединений к одному серверу
+async def create_db_pool(pool_name, params):
+    pool = await asyncpg.create_pool(
+        **params,
+        min_size=POOL_PARAMS["min_size"],
+        max_size=POOL_PARAMS["max_size"],
+        timeout=POOL_PARAMS["connect_timeout"],
+        command_timeout=POOL_PARAMS["command_timeout"],
+        max_inactive_connection_lifetime=POOL_PARAMS["max_inactive_connection_lifetime"],
+        statement_cache_size=POOL_PARAMS["statement_cache_size"],
     )
+    logger.info(f"DB pool {pool_name} created: min_size={POOL_PARAMS['min_size']}, max_size={POOL_PARAMS['max_size']}")
+    return pool
+
+# Функция для создания пулов реплик. Недоступная при запуске реплика пропускается,
+# ее чтения берет на себя основной сервер
+async def create_replica_pools():
+    pools = []
+    for index, params in enumerate(DB_REPLICA_PARAMS):
+        try:
+            pools.append((f"replica_{index}", await create_db_pool(f"replica_{index}", params)))
+        except (*REPLICA_FAILURE_ERRORS, asyncpg.PostgresError) as e:
+            logger.error(f"Replica {index} is unavailable, reads will use the primary: {e}")
+    return pools
+
+# Функция для получения соединения с основным сервером: async with acquire_connection() as conn.
+# Все записи идут через нее, поэтому она же открывает окно read-your-writes для текущего пользователя
+@asynccontextmanager
+async def acquire_connection():
+    pool = await get_db_pool()
+    mark_recent_write()
+    async with pool.acquire(timeout=POOL_PARAMS["acquire_timeout"]) as conn:
+        yield conn
+
+# Функция для отметки, что текущий пользователь только что обращался к основному серверу
+def mark_recent_write():
+    user_id = current_user_id.get()
+    if user_id is None:
+        return
+    now = time.monotonic()
+    recent_writers[user_id] = now + REPLICA_PARAMS["read_your_writes_window"]
+    recent_writers.move_to_end(user_id)
+    # Окно одинаковое для всех, поэтому истекшие записи всегда в начале
+    while recent_writers and next(iter(recent_writers.values())) <= now:
+        recent_writers.popitem(last=False)
+
+def is_recent_writer():
+    user_id = current_user_id.get()
+    return user_id is not None and recent_writers.get(user_id, 0) > time.monotonic()
+
+# Функция для выбора пула для чтения: (имя пула, пул). Реплики чередуются; основной сервер
+# используется без реплик, по запросу и в окне read-your-writes текущего пользователя
+async def get_read_pool(use_primary=False):
+    global replica_counter
+    pool = await get_db_pool()
+    if use_primary or not replica_pools or is_recent_writer():
+        return "primary", pool
+    replica_counter += 1
+    return replica_pools[replica_counter % len(replica_pools)]
+
+# Функция для закрытия пулов соединений
+async def close_db_pool():
+    global db_pool
+    for pool_name, pool in replica_pools:
+        await pool.close()
+        logger.info(f"DB pool {pool_name} closed")
+    replica_pools.clear()
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
+        logger.info("DB pool closed")
+
+# Ошибки, при которых чтение с реплики повторяется на основном сервере: реплика недоступна,
+# разорвала соединение или еще восстанавливается и не принимает подключения
+REPLICA_FAILURE_ERRORS = (
+    OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError,
+)
+
+# Функция для выполнения именованного запроса на чтение из реестра PREPARED_STATEMENTS.
+# Запрос идет на реплику (см. get_read_pool); если реплика недоступна - на основной сервер
+async def fetch_prepared(name, *params, use_primary=False):
+    pool_name, pool = await get_read_pool(use_primary)
+    try:
+        try:
+            result = await fetch_prepared_from(pool_name, pool, name, params)
+        except REPLICA_FAILURE_ERRORS as e:
+            if pool_name == "primary":
+                raise
+            logger.warning(f"Replica {pool_name} failed for {name}, retrying on the primary: {e}")
+            pool_name, pool = await get_read_pool(use_primary=True)
+            result = await fetch_prepared_from(pool_name, pool, name, params)
+    except Exception as e:
+        logging.error(f"Error executing prepared statement: {name}")
+        logging.error(f"With params: {params}")
+        logging.error(f"Error details: {e}", exc_info=True)
+        raise
+    maybe_explain_query(name, params)
+    return result
+
+# Подготовленный запрос живет только внутри своего соединения, поэтому выполняется в том же
+# блоке acquire через кэш asyncpg; устаревший после изменения схемы запрос asyncpg готовит заново
+async def fetch_prepared_from(pool_name, pool, name, params):
+    query = PREPARED_STATEMENTS[name]
+    async with observe_query(name, params), pool.acquire(timeout=POOL_PARAMS["acquire_timeout"]) as conn:
+        cached = is_statement_cached(conn, query)
+        if cached is not None:
+            STATEMENT_CACHE.labels(name, "hit" if cached else "miss").inc()
+        return await conn.fetch(query, *params)
+
+# Функция для проверки, подготовлен ли уже запрос в кэше соединения asyncpg. Публичного API
+# для этого нет: ключ повторяет Connection._get_statement, при другой версии asyncpg - None
+def is_statement_cached(conn, query):
+    try:
+        return conn._stmt_cache.has((query, conn._protocol.get_record_class(), False))
+    except AttributeError:
+        return None
+
+# Счетчики участников по ссылке конкурса, поддерживаются триггером на history.history
+PARTICIPANT_COUNTS_SCHEMA = """
+    CREATE TABLE contests.participant_counts (
+        link text PRIMARY KEY,
+        participant_count bigint NOT NULL DEFAULT 0
+    );
+
+    CREATE OR REPLACE FUNCTION contests.update_participant_counts() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.link IS NOT NULL THEN
+            INSERT INTO contests.participant_counts AS pc (link, participant_count)
+            VALUES (NEW.link, 1)
+            ON CONFLICT (link) DO UPDATE SET participant_count = pc.participant_count + 1;
+        END IF;
+        IF TG_OP IN ('DELETE', 'UPDATE') AND OLD.link IS NOT NULL THEN
+            UPDATE contests.participant_counts
+            SET participant_count = participant_count - 1
+            WHERE link = OLD.link;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER history_participant_counts
+    AFTER INSERT OR DELETE ON history.history
+    FOR EACH ROW EXECUTE FUNCTION contests.update_participant_counts();
+
+    CREATE TRIGGER history_participant_counts_link
+    AFTER UPDATE OF link ON history.history
+    FOR EACH ROW WHEN (OLD.link IS DISTINCT FROM NEW.link)
+    EXECUTE FUNCTION contests.update_participant_counts();
+
+    INSERT INTO contests.participant_counts (link, participant_count)
+    SELECT link, COUNT(DISTINCT id) FROM history.history
+    WHERE link IS NOT NULL
+    GROUP BY link;
+"""
+
+# Создание таблицы счетчиков участников и первичное заполнение из history.history
+async def ensure_participant_counts(conn):
+    exists = await conn.fetchval("SELECT to_regclass('contests.participant_counts') IS NOT NULL")
+    if exists:
+        return
+    logger.info("Creating contests.participant_counts and backfilling from history.history")
+    # Блокируем запись в history на время установки триггера и заполнения, чтобы не потерять строки
+    await conn.execute("LOCK TABLE history.history IN SHARE MODE")
+    await conn.execute(PARTICIPANT_COUNTS_SCHEMA)
+
+# Таблицы для хранения состояния бота (user_data и состояния разговоров)
+BOT_STATE_SCHEMA = """
+    CREATE SCHEMA IF NOT EXISTS bot_state;
+
+    CREATE TABLE IF NOT EXISTS bot_state.user_data (
+        user_id bigint NOT NULL,
+        key text NOT NULL,
+        value jsonb NOT NULL,
+        PRIMARY KEY (user_id, key)
+    );
+
+    CREATE TABLE IF NOT EXISTS bot_state.conversations (
+        name text NOT NULL,
+        key text NOT NULL,
+        state integer NOT NULL,
+        PRIMARY KEY (name, key)
+    );
+"""
+
+# Время напоминания для отслеживаемых конкурсов и частичный индекс по еще не отправленным
+TRACKED_REMINDERS_SCHEMA = """
+    ALTER TABLE contests.tracked_contests ADD COLUMN IF NOT EXISTS remind_at timestamptz;
+    ALTER TABLE contests.tracked_contests ADD COLUMN IF NOT EXISTS reminded_at timestamptz;
+
+    CREATE INDEX IF NOT EXISTS tracked_contests_due_idx
+    ON contests.tracked_contests (remind_at)
+    WHERE reminded_at IS NULL;
+"""
+
+# Заполнение времени напоминания для строк, добавленных до появления колонки remind_at
+TRACKED_REMINDERS_BACKFILL = """
+    UPDATE contests.tracked_contests
+    SET remind_at = to_date(date, 'DD.MM.YYYY') + make_interval(hours => $1)
+    WHERE remind_at IS NULL AND reminded_at IS NULL
+"""
+
+# Стабильные идентификаторы строк для данных инлайн-кнопок
+ROW_IDS_SCHEMA = """
+    ALTER TABLE contests.pending_contests ADD COLUMN IF NOT EXISTS id bigserial;
+    ALTER TABLE contests.tracked_contests ADD COLUMN IF NOT EXISTS id bigserial;
+    CREATE UNIQUE INDEX IF NOT EXISTS pending_contests_id_idx ON contests.pending_contests (id);
+    CREATE UNIQUE INDEX IF NOT EXISTS tracked_contests_id_idx ON contests.tracked_contests (id);
+"""
+
+# Канонический ключ ссылки для точного поиска по индексу
+LINK_KEY_SCHEMA = """
+    ALTER TABLE contests.contests ADD COLUMN IF NOT EXISTS link_key text;
+    ALTER TABLE contests.pending_contests ADD COLUMN IF NOT EXISTS link_key text;
+    CREATE INDEX IF NOT EXISTS contests_link_key_idx ON contests.contests (link_key);
+    CREATE INDEX IF NOT EXISTS pending_contests_link_key_idx ON contests.pending_contests (link_key);
+"""
+
+# Заполнение link_key одним UPDATE на таблицу: для строк без ключа или (missing_only=False)
+# для всех строк, чей ключ отличается от текущего канонического вида
+async def backfill_link_keys(conn, missing_only=True):
+    condition = "link_key IS NULL AND " if missing_only else ""
+    for table in ('contests.contests', 'contests.pending_contests'):
+        rows = await conn.fetch(f"SELECT DISTINCT link FROM {table} WHERE {condition}link IS NOT NULL")
+        if not rows:
+            continue
+        links = [row['link'] for row in rows]
+        status = await conn.execute(f"""
+            UPDATE {table} t SET link_key = k.link_key
+            FROM unnest($1::text[], $2::text[]) AS k(link, link_key)
+            WHERE t.link = k.link AND t.link_key IS DISTINCT FROM k.link_key
+        """, links, [canonicalize_link(link) for link in links])
+        logger.info(f"Backfilled link_key in {table}: {status}")
+
+# Отложенные удаления сообщений, переживающие перезапуск
+MESSAGE_CLEANUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS bot_state.pending_deletions (
+        chat_id bigint NOT NULL,
+        message_id bigint NOT NULL,
+        delete_after timestamptz NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    );
+    CREATE INDEX IF NOT EXISTS pending_deletions_due_idx ON bot_state.pending_deletions (delete_after);
+"""
+
+# Пересчет времени неотправленных напоминаний в явном часовом поясе; конкурсы прошедших дней
+# помечаются отправленными, чтобы после заполнения колонки не уйти рассылкой по всей истории
+TRACKED_REMINDERS_FIX = """
+    UPDATE contests.tracked_contests
+    SET remind_at = (date + make_interval(hours => $1)) AT TIME ZONE $2,
+        reminded_at = CASE WHEN date < (now() AT TIME ZONE $2)::date THEN now() END
+    WHERE reminded_at IS NULL AND date IS NOT NULL
+"""
+
+async def apply_tracked_reminders(conn):
+    await conn.execute(TRACKED_REMINDERS_SCHEMA)
+    await conn.execute(TRACKED_REMINDERS_BACKFILL, REMINDER_PARAMS["hour"])
+
+
+async def fix_tracked_reminders(conn):
+    status = await conn.execute(TRACKED_REMINDERS_FIX, REMINDER_PARAMS["hour"], REMINDER_PARAMS["timezone"])
+    logger.info(f"Recomputed pending tracked contest reminders: {status}")
+
+
+async def apply_link_keys(conn):
+    await conn.execute(LINK_KEY_SCHEMA)
+    await backfill_link_keys(conn)
+
+
+# Таблицы с колонкой date, которая раньше хранилась строкой ДД.ММ.ГГГГ
+DATE_COLUMN_TABLES = ('contests', 'pending_contests', 'tracked_contests')
+
+
+# Перевод колонок date из строк ДД.ММ.ГГГГ в тип DATE на месте
+async def convert_date_columns(conn):
+    for table in DATE_COLUMN_TABLES:
+        data_type = await conn.fetchval("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = 'contests' AND table_name = $1 AND column_name = 'date'
+        """, table)
+        if data_type is None or data_type == 'date':
+            continue
+        logger.info(f"Converting contests.{table}.date from {data_type} to date")
+        await conn.execute(f"""
+            ALTER TABLE contests.{table}
+            ALTER COLUMN date TYPE date USING to_date(NULLIF(btrim(date), ''), 'DD.MM.YYYY')
+        """)
+
+
+# Индексы под фильтры и сортировку списков, счетчики участников и отслеживаемые конкурсы
+DATE_INDEXES_SCHEMA = """
+    CREATE INDEX IF NOT EXISTS contests_status_date_idx ON contests.contests (status, date, link);
+    CREATE INDEX IF NOT EXISTS history_link_idx ON history.history (link);
+    CREATE INDEX IF NOT EXISTS tracked_contests_user_id_idx ON contests.tracked_contests (user_id);
+"""
+
+# Функции обслуживания разделов: создание месячных разделов вперед (строки месяца,
+# попавшие в раздел по умолчанию, переносятся в новый раздел) и отсоединение старых
+CONTEST_PARTITION_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION contests.ensure_contest_partitions(from_month date, months_ahead integer)
+    RETURNS void AS $$
+    DECLARE
+        month_start date := date_trunc('month', from_month)::date;
+        last_month date := (date_trunc('month', current_date) + make_interval(months => months_ahead))::date;
+        month_end date;
+        partition_name text;
+    BEGIN
+        WHILE month_start <= last_month LOOP
+            month_end := (month_start + interval '1 month')::date;
+            partition_name := 'contests_' || to_char(month_start, 'YYYY_MM');
+            IF to_regclass(format('contests.%I', partition_name)) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE contests.%I (LIKE contests.contests INCLUDING ALL)',
+                    partition_name);
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM contests.contests_default WHERE date >= %L AND date < %L RETURNING *) ' ||
+                    'INSERT INTO contests.%I SELECT * FROM moved',
+                    month_start, month_end, partition_name);
+                EXECUTE format(
+                    'ALTER TABLE contests.contests ATTACH PARTITION contests.%I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end);
+            END IF;
+            month_start := month_end;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION contests.detach_old_contest_partitions(keep_months integer)
+    RETURNS SETOF text AS $$
+    DECLARE
+        cutoff date := (date_trunc('month', current_date) - make_interval(months => keep_months))::date;
+        part record;
+    BEGIN
+        FOR part IN
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'contests.contests'::regclass AND c.relname ~ '^contests_[0-9]{4}_[0-9]{2}$'
+        LOOP
+            IF to_date(substr(part.relname, 10), 'YYYY_MM') < cutoff THEN
+                EXECUTE format('ALTER TABLE contests.contests DETACH PARTITION contests.%I', part.relname);
+                RETURN NEXT part.relname;
+            END IF;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# Индексы основной таблицы, создаются на секционированной таблице и наследуются разделами
+CONTEST_PARTITION_INDEXES = """
+    CREATE INDEX IF NOT EXISTS contests_status_date_idx ON contests.contests (status, date, link);
+    CREATE INDEX IF NOT EXISTS contests_link_key_idx ON contests.contests (link_key);
+"""
+
+# Последовательности (serial), принадлежавшие колонкам несекционированной таблицы
+OWNED_SEQUENCES_QUERY = """
+    SELECT s.relname AS sequence_name, a.attname AS column_name
+    FROM pg_depend d
+    JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+    JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+    WHERE d.refobjid = 'contests.contests_unpartitioned'::regclass AND d.deptype = 'a'
+"""
+
+
+# Препятствия для пересоздания таблицы: внешние ключи на нее (DROP TABLE не пройдет)
+# и identity-колонки (их последовательность не переносится)
+PARTITION_BLOCKERS_QUERY = """
+    SELECT format('внешний ключ %s таблицы %s', conname, conrelid::regclass) AS blocker
+    FROM pg_constraint
+    WHERE contype = 'f' AND confrelid = 'contests.contests'::regclass
+    UNION ALL
+    SELECT format('identity-колонка %s', attname)
+    FROM pg_attribute
+    WHERE attrelid = 'contests.contests'::regclass AND attidentity <> '' AND NOT attisdropped
+"""
+
+# Индексы несекционированной таблицы: ограничение (p/u), уникальность, колонки ключа
+# (NULL при индексе по выражению) и определение
+UNPARTITIONED_INDEXES_QUERY = """
+    SELECT ic.relname AS index_name, con.conname, con.contype, i.indisunique,
+           pg_get_indexdef(i.indexrelid) AS definition,
+           CASE WHEN 0 <> ALL (i.indkey::int2[]) THEN ARRAY(
+               SELECT a.attname
+               FROM unnest((i.indkey::int2[])[0:i.indnkeyatts - 1]) WITH ORDINALITY AS k(attnum, ord)
+               JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+               ORDER BY k.ord
+           ) END AS columns
+    FROM pg_index i
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+    WHERE i.indrelid = 'contests.contests_unpartitioned'::regclass
+"""
+
+
+# Функция для построения DDL индексов секционированной таблицы по индексам исходной.
+# Уникальные ключи секционированной таблицы обязаны включать ключ секционирования date
+def get_partitioned_index_statements(indexes):
+    statements = []
+    for index in indexes:
+        if not index['indisunique']:
+            statements.append(re.sub(
+                r" ON (contests\.)?contests_unpartitioned ", " ON contests.contests ", index['definition'], count=1))
+            continue
+        if index['columns'] is None:
+            raise RuntimeError(
+                f"Уникальный индекс по выражению {index['index_name']} нельзя перенести на таблицу, "
+                f"секционированную по date; удалите его перед миграцией"
+            )
+        columns = ", ".join(list(index['columns']) + ([] if 'date' in index['columns'] else ['date']))
+        if index['contype'] == 'p':
+            statements.append(f"ALTER TABLE contests.contests ADD CONSTRAINT {index['conname']} PRIMARY KEY ({columns})")
+        elif index['contype'] == 'u':
+            statements.append(f"ALTER TABLE contests.contests ADD CONSTRAINT {index['conname']} UNIQUE ({columns})")
+        else:
+            statements.append(f"CREATE UNIQUE INDEX {index['index_name']} ON contests.contests ({columns})")
+    return statements
+
+
+# Перевод contests.contests в таблицу, секционированную по месяцам date, с разделом по умолчанию
+# (строки без даты или за еще не созданные месяцы). Данные переносятся одной транзакцией.
+# Первичный ключ и уникальные ограничения пересоздаются с добавленной колонкой date,
+# остальные индексы - как были; при внешних ключах на таблицу миграция останавливается
+async def partition_contests(conn):
+    await conn.execute(CONTEST_PARTITION_FUNCTIONS)
+    if await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = 'contests.contests'::regclass"):
+        return
+
+    logger.info("Converting contests.contests to a table partitioned by month")
+    await conn.execute("LOCK TABLE contests.contests IN ACCESS EXCLUSIVE MODE")
+    blockers = [row['blocker'] for row in await conn.fetch(PARTITION_BLOCKERS_QUERY)]
+    if blockers:
+        raise RuntimeError(
+            f"contests.contests нельзя автоматически секционировать: {', '.join(blockers)}. "
+            f"Перенесите их вручную и перезапустите бота"
+        )
+    await conn.execute("ALTER TABLE contests.contests RENAME TO contests_unpartitioned")
+    await conn.execute("""
+        CREATE TABLE contests.contests
+        (LIKE contests.contests_unpartitioned INCLUDING ALL EXCLUDING INDEXES)
+        PARTITION BY RANGE (date)
+    """)
+    index_statements = get_partitioned_index_statements(await conn.fetch(UNPARTITIONED_INDEXES_QUERY))
+    await conn.execute("CREATE TABLE contests.contests_default PARTITION OF contests.contests DEFAULT")
+    await conn.execute("""
+        SELECT contests.ensure_contest_partitions(
+            COALESCE((SELECT MIN(date) FROM contests.contests_unpartitioned), current_date), $1
+        )
+    """, PARTITION_PARAMS["months_ahead"])
+    await conn.execute("INSERT INTO contests.contests SELECT * FROM contests.contests_unpartitioned")
+    for row in await conn.fetch(OWNED_SEQUENCES_QUERY):
+        await conn.execute(
+            f"ALTER SEQUENCE contests.{row['sequence_name']} OWNED BY contests.contests.{row['column_name']}"
+        )
+    await conn.execute("DROP TABLE contests.contests_unpartitioned")
+    # Имена индексов освобождаются только после удаления исходной таблицы
+    for statement in index_statements:
+        await conn.execute(statement)
+    await conn.execute(CONTEST_PARTITION_INDEXES)
+
+
+# Триграммный индекс для поиска подстроки в ссылке и доп. каналах
+SEARCH_INDEX_SCHEMA = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS contests_search_trgm_idx ON contests.contests
+    USING gin ((link || ' ' || coalesce(dop_channels::text, '')) gin_trgm_ops);
+"""
+
+# Версионированные миграции схемы: (версия, описание, SQL или функция от соединения).
+# Каждая применяется один раз в своей транзакции и записывается в bot_state.schema_migrations.
+# Новые миграции добавляются только в конец списка, примененные не меняются
+MIGRATIONS = [
+    (1, "participant counts rollup", ensure_participant_counts),
+    (2, "bot state tables", BOT_STATE_SCHEMA),
+    (3, "pending message deletions", MESSAGE_CLEANUP_SCHEMA),
+    (4, "tracked contest reminders", apply_tracked_reminders),
+    (5, "stable row ids", ROW_IDS_SCHEMA),
+    (6, "canonical link keys", apply_link_keys),
+    (7, "date columns as DATE", convert_date_columns),
+    (8, "listing, history and tracked contest indexes", DATE_INDEXES_SCHEMA),
+    (9, "contests partitioned by month", partition_contests),
+    (10, "trigram search index", SEARCH_INDEX_SCHEMA),
+    (11, "link keys keep invite hashes and start payloads",
+     functools.partial(backfill_link_keys, missing_only=False)),
+    (12, "reminders in explicit timezone, past contests marked as reminded", fix_tracked_reminders),
+]
+
+SCHEMA_MIGRATIONS_TABLE = """
+    CREATE SCHEMA IF NOT EXISTS bot_state;
+
+    CREATE TABLE IF NOT EXISTS bot_state.schema_migrations (
+        version integer PRIMARY KEY,
+        description text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+# Ключ advisory-блокировки: несколько запускаемых одновременно процессов применяют миграции по очереди
+MIGRATIONS_LOCK_ID = 4021001
+
+
+# Функция для применения недостающих миграций при запуске
+async def run_migrations(pool):
+    async with pool.acquire(timeout=POOL_PARAMS["acquire_timeout"]) as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+        try:
+            await conn.execute(SCHEMA_MIGRATIONS_TABLE)
+            applied = {row['version'] for row in await conn.fetch("SELECT version FROM bot_state.schema_migrations")}
+            for version, description, step in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info(f"Applying schema migration {version}: {description}")
+                async with conn.transaction():
+                    if isinstance(step, str):
+                        await conn.execute(step)
+                    else:
+                        await step(conn)
+                    await conn.execute(
+                        "INSERT INTO bot_state.schema_migrations (version, description) VALUES ($1, $2)",
+                        version, description
+                    )
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+
+# Хранение user_data и состояний разговоров в PostgreSQL. Записываются только
+# изменившиеся ключи; приложение передает изменения раз в flush_interval секунд (update_interval),
+# и они пишутся одной транзакцией сразу после этого прохода
+class PostgresPersistence(BasePersistence):
+    def __init__(self, flush_interval, retry_delay):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval,
+        )
+        self.retry_delay = retry_delay
+        # Последнее записанное состояние: {user_id: {key: значение после разбора JSON}}
+        self._user_data_snapshot = {}
+        # Несохраненные изменения: {(user_id, key): json или None для удаления}
+        self._pending_user_data = {}
+        self._dropped_users = set()
+        # Несохраненные состояния разговоров: {(name, key): state или None для удаления}
+        self._pending_conversations = {}
+        self._unserializable_keys = set()
+        # Текущие состояния разговоров для метрик: {(name, key): state}
+        self._conversation_states = {}
+        # Запланированная запись (после прохода приложения или через retry_delay после ошибки)
+        # и все незавершенные записи
+        self._write_task = None
+        self._write_tasks = set()
+
+    async def get_user_data(self):
+        async with observe_query("load_user_data"), acquire_connection() as conn:
+            rows = await conn.fetch("SELECT user_id, key, value FROM bot_state.user_data")
+        user_data = {}
+        for row in rows:
+            user_data.setdefault(row['user_id'], {})[row['key']] = json.loads(row['value'])
+            # Отдельная копия: изменения user_data на месте не должны менять снимок
+            self._user_data_snapshot.setdefault(row['user_id'], {})[row['key']] = json.loads(row['value'])
+        logger.info(f"Restored user_data for {len(user_data)} users")
+        return user_data
+
+    async def update_user_data(self, user_id, data):
+        old = self._user_data_snapshot.get(user_id, {})
+        new = {}
+        for key, value in data.items():
+            key = str(key)
+            try:
+                value_json = json.dumps(value, ensure_ascii=False)
+            except TypeError:
+                if key not in self._unserializable_keys:
+                    self._unserializable_keys.add(key)
+                    logger.warning(f"user_data key '{key}' is not JSON serializable and will not be persisted")
+                if key in old:
+                    new[key] = old[key]
+                continue
+            # Сравниваются разобранные значения: текст jsonb из базы не совпадает с json.dumps побайтно
+            new[key] = json.loads(value_json)
+            if key not in old or old[key] != new[key]:
+                self._pending_user_data[(user_id, key)] = value_json
+        for key in old.keys() - new.keys():
+            self._pending_user_data[(user_id, key)] = None
+        self._user_data_snapshot[user_id] = new
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._user_data_snapshot.pop(user_id, None)
+        for pending_key in [k for k in self._pending_user_data if k[0] == user_id]:
+            del self._pending_user_data[pending_key]
+        self._dropped_users.add(user_id)
+        self._schedule_write()
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_conversations(self, name):
+        async with observe_query("load_conversations", (name,)), acquire_connection() as conn:
+            rows = await conn.fetch("SELECT key, state FROM bot_state.conversations WHERE name = $1", name)
+        logger.info(f"Restored {len(rows)} '{name}' conversations")
+        conversations = {tuple(json.loads(row['key'])): row['state'] for row in rows}
+        for key, state in conversations.items():
+            self._conversation_states[(name, key)] = state
+            record_conversation_state(name, None, state)
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        old_state = self._conversation_states.pop((name, key), None)
+        if new_state is not None:
+            self._conversation_states[(name, key)] = new_state
+        record_conversation_state(name, old_state, new_state)
+        self._pending_conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_write()
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        if self._write_task is not None:
+            self._write_task.cancel()
+            self._write_task = None
+        await asyncio.gather(*self._write_tasks, return_exceptions=True)
+        await self._write_pending()
+
+    # Запись выполняется задачей, запущенной после текущего прохода приложения по изменениям,
+    # поэтому все update_* одного прохода попадают в одну транзакцию
+    def _schedule_write(self, delay=0):
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._delayed_write(delay))
+            self._write_tasks.add(self._write_task)
+            self._write_task.add_done_callback(self._write_tasks.discard)
+
+    async def _delayed_write(self, delay):
+        await asyncio.sleep(delay)
+        self._write_task = None
+        await self._write_pending()
+
+    async def _write_pending(self):
+        user_data, self._pending_user_data = self._pending_user_data, {}
+        dropped_users, self._dropped_users = self._dropped_users, set()
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        if not (user_data or dropped_users or conversations):
+            return
+
+        upserts = [(user_id, key, value) for (user_id, key), value in user_data.items() if value is not None]
+        deletes = [(user_id, key) for (user_id, key), value in user_data.items() if value is None]
+        states = [(name, key, state) for (name, key), state in conversations.items() if state is not None]
+        ended = [(name, key) for (name, key), state in conversations.items() if state is None]
+
+        try:
+            async with observe_query("persistence_flush"), acquire_connection() as conn:
+                async with conn.transaction():
+                    if dropped_users:
+                        await conn.execute(
+                            "DELETE FROM bot_state.user_data WHERE user_id = ANY($1::bigint[])", list(dropped_users)
+                        )
+                    if deletes:
+                        await conn.executemany(
+                            "DELETE FROM bot_state.user_data WHERE user_id = $1 AND key = $2", deletes
+                        )
+                    if upserts:
+                        await conn.executemany("""
+                            INSERT INTO bot_state.user_data (user_id, key, value) VALUES ($1, $2, $3::jsonb)
+                            ON CONFLICT (user_id, key) DO UPDATE SET value = EXCLUDED.value
+                        """, upserts)
+                    if ended:
+                        await conn.executemany(
+                            "DELETE FROM bot_state.conversations WHERE name = $1 AND key = $2", ended
+                        )
+                    if states:
+                        await conn.executemany("""
+                            INSERT INTO bot_state.conversations (name, key, state) VALUES ($1, $2, $3)
+                            ON CONFLICT (name, key) DO UPDATE SET state = EXCLUDED.state
+                        """, states)
+        except Exception as e:
+            logging.error(f"Error flushing persistence: {e}", exc_info=True)
+            # Возвращаем изменения в буфер, если за это время не появились более новые
+            for pending_key, value in user_data.items():
+                self._pending_user_data.setdefault(pending_key, value)
+            self._dropped_users |= dropped_users
+            for pending_key, state in conversations.items():
+                self._pending_conversations.setdefault(pending_key, state)
+            self._schedule_write(self.retry_delay)
+            return
+
+        logger.info(f"Persisted {len(upserts) + len(deletes)} user_data changes, {len(conversations)} conversation states")
+
 
 # Функция для подключения к базе данных
 def get_db_connection():
@@ -87,28 +1493,28 @@ def get_db_connection():
 
 
 # Функция для выполнения SQL-запросов
-async def execute_query(query, params=None):
-    conn = await asyncpg.connect(**DB_PARAMS)
+# name - имя запроса в метриках и журнале медленных запросов
+async def execute_query(query, params=None, name="unnamed"):
     try:
-        if params:
-            result = await conn.fetch(query, *params)
-        else:
-            result = await conn.fetch(query)
-        return result
+        async with observe_query(name, params), acquire_connection() as conn:
+            if params:
+                result = await conn.fetch(query, *params)
+            else:
+                result = await conn.fetch(query)
+            return result
     except Exception as e:
-        logging.error(f"Error executing query: {query}")
+        logging.error(f"Error executing query {name}: {query}")
         logging.error(f"With params: {params}")
         logging.error(f"Error details: {e}", exc_info=True)
         raise
-    finally:
-        await conn.close()
 
 async def add_contest_to_db(link, date, dop_channels, status='Активен'):
     query = """
-        INSERT INTO contests.contests (link, date, dop_channels, status)
-        VALUES ($1, $2, $3, $4)
+        INSERT INTO contests.contests (link, link_key, date, dop_channels, status)
+        VALUES ($1, $2, $3, $4, $5)
     """
-    await execute_query(query, (link, date, dop_channels, status))
+    await execute_query(query, (link, canonicalize_link(link), to_db_date(date), dop_channels, status), name="add_contest")
+    invalidate_contests_cache()
 
 
 # Функция для получения основной клавиатуры
@@ -176,11 +1582,12 @@ async def update_contest_status(update, context):
     query = """
         UPDATE contests.contests
         SET status = 'Завершен'
-        WHERE link = \$1
-        RETURNING *
+        WHERE link_key = $1
+        RETURNING link
     """
 
-    result = await execute_query(query, (text,))
+    result = await execute_query(query, (canonicalize_link(text),), name="update_contest_status")
+    invalidate_contests_cache()
 
     if result:
         await update.message.reply_text(
@@ -231,9 +1638,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Функция для проверки наличия ссылки в базе данных
 async def link_exists(link):
-    query = "SELECT EXISTS(SELECT 1 FROM contests.contests WHERE link = \$1) AS exists"
     try:
-        result = await execute_query(query, (link,))
+        result = await fetch_prepared("link_exists", canonicalize_link(link))
         if result and len(result) > 0:
             return result[0]['exists']
         return False
@@ -251,13 +1657,7 @@ async def handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Удаляем приветственное сообщение, если оно есть
     if 'welcome_message_id' in context.user_data:
-        try:
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=context.user_data['welcome_message_id']
-            )
-        except Exception as e:
-            print(f"Не удалось удалить приветственное сообщение: {e}")
+        schedule_message_deletion(update.effective_chat.id, context.user_data['welcome_message_id'])
         del context.user_data['welcome_message_id']
 
     # Обработка ввода для различных состояний
@@ -269,13 +1669,12 @@ async def handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await handle_tracked_date_input(update, context)
     elif context.user_data.get('waiting_for_date'):
         return await handle_date_input(update, context)
+    elif context.user_data.get('waiting_for_search'):
+        return await handle_search_input(update, context)
 
     # Удаляем сообщение пользователя только если это не обработка дополнительных каналов
     if not context.user_data.get('waiting_for_pending_dop_channels'):
-        try:
-            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=update.message.message_id)
-        except Exception as e:
-            print(f"Не удалось удалить сообщение пользователя: {e}")
+        schedule_message_deletion(update.effective_chat.id, update.message.message_id)
 
     # Обработка URL
     if is_url(text):
@@ -300,42 +1699,79 @@ async def handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return WAITING_INPUT
 
+# Отпечатки последнего отправленного содержимого сообщений: {(chat_id, message_id): digest}
+MESSAGE_FINGERPRINTS_MAXSIZE = 10000
+message_fingerprints = OrderedDict()
+
+
+# Функция для вычисления отпечатка содержимого сообщения (текст и клавиатура)
+def get_message_fingerprint(text, reply_markup=None):
+    markup = json.dumps(reply_markup.to_dict(), sort_keys=True, ensure_ascii=False) if reply_markup else ""
+    return hashlib.blake2b(f"{text}\x00{markup}".encode(), digest_size=16).digest()
+
+
+def remember_message_fingerprint(chat_id, message_id, fingerprint):
+    message_fingerprints[(chat_id, message_id)] = fingerprint
+    message_fingerprints.move_to_end((chat_id, message_id))
+    while len(message_fingerprints) > MESSAGE_FINGERPRINTS_MAXSIZE:
+        message_fingerprints.popitem(last=False)
+
+
+def forget_message_fingerprint(chat_id, message_id):
+    message_fingerprints.pop((chat_id, message_id), None)
+
+
+# Функция для правки сообщения, только если его содержимое изменилось.
+# Возвращает False, если правка не понадобилась и запрос к Bot API не отправлялся
+async def edit_message_if_changed(bot, chat_id, message_id, text, reply_markup=None, **kwargs):
+    fingerprint = get_message_fingerprint(text, reply_markup)
+    if message_fingerprints.get((chat_id, message_id)) == fingerprint:
+        return False
+
+    try:
+        await bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=reply_markup,
+            **kwargs
+        )
+    except telegram.error.BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise e
+    remember_message_fingerprint(chat_id, message_id, fingerprint)
+    return True
+
+
 # Удаляет сообщение пользователя после ввода даты, каналов и т.д.
 async def update_or_send_message(update, context, text, reply_markup=None):
+    chat_id = update.effective_chat.id
     if 'message_id' in context.user_data:
         try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=context.user_data['message_id'],
-                text=text,
+            await edit_message_if_changed(
+                context.bot, chat_id, context.user_data['message_id'], text,
                 reply_markup=reply_markup,
                 parse_mode=ParseMode.HTML,
                 disable_web_page_preview=True
             )
+            return
         except Exception as e:
             print(f"Не удалось отредактировать сообщение: {e}")
-            message = await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=text,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-            context.user_data['message_id'] = message.message_id
-    else:
-        message = await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML,
-            disable_web_page_preview=True
-        )
-        context.user_data['message_id'] = message.message_id
+
+    message = await context.bot.send_message(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True
+    )
+    context.user_data['message_id'] = message.message_id
+    remember_message_fingerprint(chat_id, message.message_id, get_message_fingerprint(text, reply_markup))
 
 async def handle_url_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_cancel_message(update, context)
 
-    url = update.message.text
+    url = prepare_link(update.message.text)
     context.user_data['link'] = url
 
     logging.info(f"Handling URL input: {url}")
@@ -439,7 +1875,7 @@ async def show_tracked_contests(update: Update, context: ContextTypes.DEFAULT_TY
         message = "Отслеживаемые конкурсы:\n\n"
         for contest in tracked_contests:
             link = contest.get('link', 'Ссылка отсутствует')
-            date = contest.get('date', 'Дата не указана')
+            date = format_date(contest.get('date')) or 'Дата не указана'
             message += f"<a href='{link}'>{link}</a>\nДата: {date}\n\n"
 
     keyboard = [
@@ -498,7 +1934,9 @@ async def handle_tracked_date_input(update, context):
             return WAITING_INPUT
 
         # Добавляем конкурс в базу данных
-        add_tracked_contest_to_db(user_id, link, date)
+        remind_at = await add_tracked_contest_to_db(user_id, link, date)
+        if remind_at is not None:
+            schedule_reminder_job(context.application, remind_at)
 
         # Проверяем наличие ID сообщения для обновления
         if 'tracking_message_id' in context.user_data:
@@ -530,31 +1968,129 @@ async def handle_tracked_date_input(update, context):
         return WAITING_FOR_TRACKED_DATE
 
 # Функция для добавления конкурса в базу данных
+# Функция для добавления конкурса в отслеживаемые, возвращает время напоминания или None,
+# если день конкурса уже прошел: такая строка сразу помечается напомненной, как в миграции 12
 async def add_tracked_contest_to_db(user_id, link, date):
+    remind_at = get_remind_at(date)
+    now = datetime.now(REMINDER_TZ)
+    reminded_at = now if remind_at.date() < now.date() else None
     query = """
-        INSERT INTO contests.tracked_contests (user_id, link, date)
-        VALUES ($1, $2, $3)
+        INSERT INTO contests.tracked_contests (user_id, link, date, remind_at, reminded_at)
+        VALUES ($1, $2, $3, $4, $5)
         ON CONFLICT (user_id, link) DO UPDATE
-        SET date = EXCLUDED.date
+        SET date = EXCLUDED.date, remind_at = EXCLUDED.remind_at, reminded_at = EXCLUDED.reminded_at
     """
-    await execute_query(query, (user_id, link, date))
+    await execute_query(query, (user_id, link, to_db_date(date), remind_at, reminded_at), name="add_tracked_contest")
+    return None if reminded_at else remind_at
+
+
+# Часовой пояс дат конкурсов для напоминаний
+REMINDER_TZ = ZoneInfo(REMINDER_PARAMS["timezone"])
+
+
+# Функция для вычисления времени напоминания по дате конкурса (ДД.ММ.ГГГГ)
+def get_remind_at(date_text):
+    contest_date = datetime.strptime(date_text, "%d.%m.%Y")
+    return contest_date.replace(hour=REMINDER_PARAMS["hour"], tzinfo=REMINDER_TZ)
+
+
+# Время, на которое запланирована ближайшая рассылка напоминаний
+next_reminder_at = None
+
+
+# Функция для планирования рассылки напоминаний на ближайшее время when
+def schedule_reminder_job(application, when):
+    global next_reminder_at
+    if next_reminder_at is not None and next_reminder_at <= when:
+        return
+
+    for job in application.job_queue.get_jobs_by_name(REMINDER_PARAMS["job_name"]):
+        job.schedule_removal()
+    delay = max(0, (when - datetime.now(REMINDER_TZ)).total_seconds())
+    application.job_queue.run_once(send_due_reminders, when=delay, name=REMINDER_PARAMS["job_name"])
+    next_reminder_at = when
+    logger.info(f"Next tracked contest reminder scheduled at {when}")
+
+
+# Функция для планирования рассылки по ближайшему неотправленному напоминанию
+async def schedule_next_reminder(application):
+    result = await execute_query(
+        "SELECT MIN(remind_at) AS next_remind_at FROM contests.tracked_contests WHERE reminded_at IS NULL",
+        name="next_reminder"
+    )
+    if result and result[0]['next_remind_at']:
+        schedule_reminder_job(application, result[0]['next_remind_at'])
+
+
+# Функция для отправки пачки напоминаний; темп отправки задает OutboundRateLimiter
+async def send_reminders(bot, rows):
+    chunk_size = REMINDER_PARAMS["send_chunk"]
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        results = await asyncio.gather(*(
+            bot.send_message(
+                chat_id=row['user_id'],
+                text=f"Напоминание: сегодня конкурс\n<a href=\"{row['link']}\">{row['link']}</a>\nДата: {format_date(row['date'])}",
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True
+            )
+            for row in chunk
+        ), return_exceptions=True)
+        for row, result in zip(chunk, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Не удалось отправить напоминание пользователю {row['user_id']}: {result}")
+
+
+# Задача рассылки: забирает наступившие напоминания одним запросом по индексу и планирует следующую
+async def send_due_reminders(context: ContextTypes.DEFAULT_TYPE):
+    global next_reminder_at
+    next_reminder_at = None
+
+    # Строки помечаются отправленными в том же запросе, так что повторный запуск их не увидит
+    claim_query = """
+        UPDATE contests.tracked_contests t
+        SET reminded_at = now()
+        FROM (
+            SELECT user_id, link FROM contests.tracked_contests
+            WHERE reminded_at IS NULL AND remind_at <= now()
+            ORDER BY remind_at
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        ) due
+        WHERE t.user_id = due.user_id AND t.link = due.link
+        RETURNING t.user_id, t.link, t.date
+    """
+    try:
+        while True:
+            rows = await execute_query(claim_query, (REMINDER_PARAMS["batch_size"],), name="claim_due_reminders")
+            if rows:
+                logger.info(f"Sending {len(rows)} tracked contest reminders")
+                await send_reminders(context.bot, rows)
+            if len(rows) < REMINDER_PARAMS["batch_size"]:
+                break
+    finally:
+        # Следующая рассылка планируется и после ошибки, иначе напоминания встанут до перезапуска
+        try:
+            await schedule_next_reminder(context.application)
+        except Exception as e:
+            logger.error(f"Не удалось запланировать напоминания: {e}")
+            retry_at = datetime.now(REMINDER_TZ) + timedelta(seconds=REMINDER_PARAMS["retry_delay"])
+            schedule_reminder_job(context.application, retry_at)
 
 # Функция для получения отслеживаемых конкурсов пользователя
 async def get_tracked_contests(user_id):
-    query = """
-        SELECT link, date FROM contests.tracked_contests
-        WHERE user_id = $1
-    """
-    return await execute_query(query, (user_id,))
+    return await fetch_prepared("tracked_contests", user_id)
 
 
-# Функция для удаления конкурса из отслеживаемых
-async def remove_tracked_contest(user_id, link):
+# Функция для удаления конкурса из отслеживаемых по id строки, возвращает удаленную ссылку
+async def remove_tracked_contest(user_id, contest_id):
     query = """
         DELETE FROM contests.tracked_contests
-        WHERE user_id = $1 AND link = $2
+        WHERE id = $1 AND user_id = $2
+        RETURNING link
     """
-    await execute_query(query, (user_id, link))
+    result = await execute_query(query, (contest_id, user_id), name="remove_tracked_contest")
+    return result[0]['link'] if result else None
 
 
 # Функция для обработки запроса на удаление отслеживаемого конкурса
@@ -571,7 +2107,10 @@ async def delete_tracked_contest(update, context):
 
     keyboard = []
     for i, contest in enumerate(tracked_contests, 1):
-        keyboard.append([InlineKeyboardButton(f"{i}. {contest['link']} - {contest['date']}", callback_data=f'delete_{i}')])
+        keyboard.append([InlineKeyboardButton(
+            f"{i}. {contest['link']} - {format_date(contest['date'])}",
+            callback_data=encode_callback('trk_del', contest['id'])
+        )])
 
     keyboard.append([InlineKeyboardButton("Отмена", callback_data='cancel_delete')])
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -588,14 +2127,10 @@ async def handle_delete_tracked(update, context):
         await show_tracked_contests(update, context)
         return WAITING_INPUT
 
-    index = int(query.data.split('_')[1]) - 1
+    _, (contest_id,) = decode_callback(query.data)
     user_id = update.effective_user.id
-    tracked_contests = await get_tracked_contests(user_id)  # Добавлен await
-
-    if 0 <= index < len(tracked_contests):
-        link_to_delete = tracked_contests[index]['link']
-        await remove_tracked_contest(user_id, link_to_delete)  # Добавлен await
 
+    if await remove_tracked_contest(user_id, contest_id):
         # Обновляем список отслеживаемых конкурсов после удаления
         updated_tracked_contests = await get_tracked_contests(user_id)  # Добавлен await
 
@@ -604,7 +2139,7 @@ async def handle_delete_tracked(update, context):
         else:
             message = "Отслеживаемые конкурсы:\n\n"
             for i, contest in enumerate(updated_tracked_contests, 1):
-                message += f"{i}. {contest['link']} - {contest['date']}\n"
+                message += f"{i}. {contest['link']} - {format_date(contest['date'])}\n"
 
         keyboard = [
             [InlineKeyboardButton("🏆 Активные", callback_data='show_active'),
@@ -647,8 +2182,9 @@ async def handle_tracked_link_input(update, context):
         link = update.message.text
 
         if is_url(link):
+            link = prepare_link(link)
             context.user_data['tracked_link'] = link
-            await update.message.delete()
+            schedule_message_deletion(update.effective_chat.id, update.message.message_id)
             await context.bot.edit_message_text(
                 chat_id=update.effective_chat.id,
                 message_id=context.user_data['tracking_message_id'],
@@ -677,10 +2213,11 @@ async def finish_contest(update, context):
     update_query = """
         UPDATE contests.contests
         SET status = 'Завершен'
-        WHERE link = $1
-        RETURNING *
+        WHERE link_key = $1
+        RETURNING link
     """
-    result = await execute_query(update_query, (link,))  # Corrected placeholder usage
+    result = await execute_query(update_query, (canonicalize_link(link),), name="finish_contest")
+    invalidate_contests_cache()
 
     if result:
         message = f"Конкурс по ссылке {link} успешно завершен. Что бы вы хотели сделать дальше?"
@@ -709,6 +2246,16 @@ def process_date(date_text):
     return date.strftime("%d.%m.%Y")
 
 
+# Функция для перевода даты ДД.ММ.ГГГГ из user_data в значение колонки DATE
+def to_db_date(date_text):
+    return datetime.strptime(date_text, "%d.%m.%Y").date()
+
+
+# Функция для вывода даты из базы в формате ДД.ММ.ГГГГ
+def format_date(value):
+    return value.strftime("%d.%m.%Y") if isinstance(value, date) else value
+
+
 # Функция для запроса недостающей информации
 async def ask_for_missing_info(update, context):
     if 'waiting_for_date' in context.user_data:
@@ -782,7 +2329,7 @@ async def channels_input(update, context):
     text = update.message.text
 
     # Удаляем сообщение пользователя
-    await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=update.message.message_id)
+    schedule_message_deletion(update.effective_chat.id, update.message.message_id)
 
     if text == "Показать все конкурсы":
         await show_contests(update, context)
@@ -840,15 +2387,17 @@ async def confirmation(update, context):
     if query.data == 'confirm':
         # Сохранение данных в базу
         insert_query = """
-            INSERT INTO contests.contests (link, date, dop_channels, status)
-            VALUES ($1, $2, $3, $4)
+            INSERT INTO contests.contests (link, link_key, date, dop_channels, status)
+            VALUES ($1, $2, $3, $4, $5)
         """
         await execute_query(insert_query, (
             context.user_data['link'],
-            context.user_data['date'],
+            canonicalize_link(context.user_data['link']),
+            to_db_date(context.user_data['date']),
             context.user_data.get('dop_channels', 'false'),
             'Активен'
-        ))
+        ), name="add_contest")
+        invalidate_contests_cache()
         message = await query.edit_message_text(
             "Данные успешно сохранены в базу данных.",
             disable_web_page_preview=True
@@ -873,67 +2422,212 @@ async def confirmation(update, context):
     return WAITING_INPUT
 
 
-async def delete_message_after_delay(bot, chat_id, message_id, delay):
-    await asyncio.sleep(delay)
+# Буфер удалений, накопленных обработчиками до следующего прохода очистки:
+# [(chat_id, message_id, delete_after)]
+pending_deletions = []
+
+# Событие, которым постановка в очередь будит фоновую очистку, и сама задача очистки;
+# создаются в post_init внутри цикла событий приложения
+cleanup_wakeup = None
+cleanup_task = None
+
+
+# Функция для постановки сообщения в очередь на удаление (через delay секунд).
+# Само удаление выполняет run_message_cleanup пачками, вне обработки запроса пользователя
+def schedule_message_deletion(chat_id, message_id, delay=0):
+    pending_deletions.append((chat_id, message_id, datetime.now().astimezone() + timedelta(seconds=delay)))
+    if cleanup_wakeup is not None:
+        cleanup_wakeup.set()
+
+
+# Функция для удаления сообщений пачками через deleteMessages, сгруппированных по чатам
+async def delete_messages_in_bulk(bot, messages):
+    by_chat = {}
+    for chat_id, message_id in messages:
+        by_chat.setdefault(chat_id, []).append(message_id)
+
+    chunk_size = CLEANUP_PARAMS["chunk_size"]
+    for chat_id, message_ids in by_chat.items():
+        for start in range(0, len(message_ids), chunk_size):
+            try:
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids[start:start + chunk_size])
+            except Exception as e:
+                logger.warning(f"Не удалось удалить сообщения в чате {chat_id}: {e}")
+
+
+# Функция для сохранения буфера удалений в базу (при остановке и для отложенных удалений)
+async def persist_message_deletions(deletions):
+    if not deletions:
+        return
+    async with observe_query("save_pending_deletions"), acquire_connection() as conn:
+        await conn.executemany("""
+            INSERT INTO bot_state.pending_deletions (chat_id, message_id, delete_after)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (chat_id, message_id) DO UPDATE SET delete_after = EXCLUDED.delete_after
+        """, deletions)
+
+
+# Проход очистки: наступившие удаления из буфера выполняются сразу, отложенные сохраняются
+# в базу; затем удаляются наступившие сообщения из базы, в том числе оставшиеся с прошлого запуска.
+# Возвращает время ближайшего отложенного удаления или None
+async def run_message_cleanup(bot):
+    global pending_deletions
+    buffered, pending_deletions = pending_deletions, []
+    now = datetime.now().astimezone()
+
+    due = [(chat_id, message_id) for chat_id, message_id, delete_after in buffered if delete_after <= now]
+    delayed = [deletion for deletion in buffered if deletion[2] > now]
     try:
-        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        await persist_message_deletions(delayed)
     except Exception as e:
-        print(f"Не удалось удалить сообщение: {e}")
+        logging.error(f"Error saving pending deletions: {e}", exc_info=True)
+        pending_deletions.extend(delayed)
 
-async def delete_cancel_message(update, context):
-    if 'cancel_message_id' in context.user_data:
+    try:
+        rows = await execute_query(
+            "SELECT chat_id, message_id FROM bot_state.pending_deletions WHERE delete_after <= now() LIMIT $1",
+            (CLEANUP_PARAMS["batch_size"],),
+            name="due_deletions"
+        )
+    except Exception:
+        # Наступившие удаления из буфера не теряются, а ждут следующего прохода
+        pending_deletions.extend(deletion for deletion in buffered if deletion[2] <= now)
+        raise
+    due.extend((row['chat_id'], row['message_id']) for row in rows)
+
+    if due:
+        await delete_messages_in_bulk(bot, due)
+    if rows:
+        await execute_query("""
+            DELETE FROM bot_state.pending_deletions d
+            USING unnest($1::bigint[], $2::bigint[]) AS done(chat_id, message_id)
+            WHERE d.chat_id = done.chat_id AND d.message_id = done.message_id
+        """, ([row['chat_id'] for row in rows], [row['message_id'] for row in rows]), name="delete_done_deletions")
+
+    result = await execute_query(
+        "SELECT MIN(delete_after) AS next_delete_after FROM bot_state.pending_deletions",
+        name="next_deletion"
+    )
+    next_due = [deletion[2] for deletion in pending_deletions]
+    if result and result[0]['next_delete_after']:
+        next_due.append(result[0]['next_delete_after'])
+    return min(next_due, default=None)
+
+
+# Фоновая очистка: проход выполняется, когда в очередь поставлено удаление, наступило
+# ближайшее отложенное удаление или истек max_sleep
+async def message_cleanup_loop(bot):
+    while True:
+        cleanup_wakeup.clear()
+        timeout = CLEANUP_PARAMS["max_sleep"]
         try:
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=context.user_data['cancel_message_id']
-            )
+            next_due = await run_message_cleanup(bot)
+            if next_due is not None:
+                timeout = min(timeout, max(0, (next_due - datetime.now().astimezone()).total_seconds()))
         except Exception as e:
-            print(f"Не удалось удалить сообщение об отмене: {e}")
+            logger.error(f"Message cleanup failed, retrying in {CLEANUP_PARAMS['retry_delay']}s: {e}")
+            timeout = CLEANUP_PARAMS["retry_delay"]
+
+        try:
+            await asyncio.wait_for(cleanup_wakeup.wait(), timeout)
+            await asyncio.sleep(CLEANUP_PARAMS["coalesce_delay"])
+        except asyncio.TimeoutError:
+            pass
+
+
+async def delete_cancel_message(update, context):
+    if 'cancel_message_id' in context.user_data:
+        schedule_message_deletion(update.effective_chat.id, context.user_data['cancel_message_id'])
         del context.user_data['cancel_message_id']
 
 async def delete_success_message(update, context):
     if 'success_message_id' in context.user_data:
-        try:
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=context.user_data['success_message_id']
-            )
-        except Exception as e:
-            print(f"Не удалось удалить сообщение об успешном сохранении: {e}")
+        schedule_message_deletion(update.effective_chat.id, context.user_data['success_message_id'])
         del context.user_data['success_message_id']
 
 
-# Функция для получения сообщения со списком конкурсов
-async def get_contests_message(status='Активен', is_admin=False):
+# Функция для выбора keyset-перехода по курсору последней показанной страницы
+def get_page_anchor(cursor, status, page):
+    if not cursor or cursor.get('status') != status or page == 1:
+        return None
+    # Границы страницы, снятые до изменения конкурсов, не годятся: страница строится через OFFSET
+    if cursor.get('version') != contests_cache.version or cursor.get('day') != date.today().isoformat():
+        return None
+    if page == cursor['page'] + 1:
+        return 'after', cursor['last']
+    if page == cursor['page'] - 1:
+        return 'before', cursor['first']
+    if page == cursor['page']:
+        return 'from', cursor['first']
+    return None
+
+
+# Функция для сохранения курсора показанной страницы: статус, номер, версия данных, день
+# и границы страницы по (date, link). Строки самой страницы в user_data не хранятся
+def make_contests_cursor(status, page, contests):
+    return {
+        'status': status,
+        'page': page,
+        'version': contests_cache.version,
+        'day': date.today().isoformat(),
+        'first': [contests[0]['date'].isoformat(), contests[0]['link']],
+        'last': [contests[-1]['date'].isoformat(), contests[-1]['link']],
+    }
+
+
+# Функция для вычисления нижней границы дат списка активных конкурсов (начало месяца)
+def get_active_since(today):
+    month_index = today.year * 12 + today.month - 1 - ACTIVE_LOOKBACK_MONTHS
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+# Функция для получения одной страницы списка конкурсов: (конкурсы, всего страниц, номер страницы)
+async def get_contests_message(status='Активен', page=1, cursor=None):
+    name, _, _ = CONTEST_LIST_FILTERS[status]
     today = date.today()
-    if status == 'Активен':
-        query = """
-            SELECT c.link, c.date, c.status, COUNT(DISTINCT h.id) as participant_count
-            FROM contests.contests c
-            LEFT JOIN history.history h ON c.link = h.link
-            WHERE c.status = $1
-            GROUP BY c.link, c.date, c.status
-            ORDER BY c.date::date
-        """
+    if status != 'Активен':
+        params = [status, today]
+    elif ACTIVE_LOOKBACK_MONTHS is None:
         params = [status]
     else:
-        query = """
-            SELECT c.link, c.date, c.status, COUNT(DISTINCT h.id) as participant_count
-            FROM contests.contests c
-            LEFT JOIN history.history h ON c.link = h.link
-            WHERE c.status = $1 AND DATE(c.date) = $2
-            GROUP BY c.link, c.date, c.status
-            ORDER BY c.date::date
-        """
-        params = [status, today]
+        params = [status, get_active_since(today)]
+
+    use_primary = contests_recently_written()
+
+    async def load_count():
+        count = await fetch_prepared(f"contests_count_{name}", *params, use_primary=use_primary)
+        return count[0]['count']
+
+    async def load_page():
+        contests = None
+        if anchor:
+            direction, (anchor_date, anchor_link) = anchor
+            contests = await fetch_prepared(
+                f"contests_{direction}_{name}", *params,
+                date.fromisoformat(anchor_date), anchor_link, CONTESTS_PER_PAGE,
+                use_primary=use_primary
+            )
+            if direction == 'before':
+                contests = list(reversed(contests))
+        if not contests:
+            contests = await fetch_prepared(
+                f"contests_page_{name}", *params, CONTESTS_PER_PAGE, (page - 1) * CONTESTS_PER_PAGE,
+                use_primary=use_primary
+            )
+        return contests
 
-    conn = await asyncpg.connect(**DB_PARAMS)
-    try:
-        contests = await conn.fetch(query, *params)
-    finally:
-        await conn.close()
+    count = await contests_cache.get_or_load(('count', status, today), load_count)
+    total_pages = ceil(count / CONTESTS_PER_PAGE)
+    if not total_pages:
+        return [], 0, 1
 
-    return contests if contests else []
+    page = max(1, min(page, total_pages))
+    # Страница кэшируется под общим для всех ключом, поэтому keyset-переход допустим только
+    # по курсору той же версии данных и того же дня: тогда он дает ту же страницу, что и OFFSET
+    anchor = get_page_anchor(cursor, status, page)
+    contests = await contests_cache.get_or_load(('page', status, today, page), load_page)
+
+    return contests, total_pages, page
 
 
 # Функция для отображения всех конкурсов
@@ -942,7 +2636,7 @@ async def show_contests(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_cancel_message(update, context)
 
     is_admin = context.user_data.get('is_admin', False)
-    contests = await get_contests_message('Активен', is_admin)
+    contests, total_pages, page = await get_contests_message('Активен')
 
     if not contests:
         message = "На данный момент нет активных конкурсов."
@@ -952,37 +2646,19 @@ async def show_contests(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(message)
         return WAITING_INPUT
 
-    page = 1
-    contests_per_page = 5
-    total_pages = ceil(len(contests) / contests_per_page)
-
-    message = await get_paginated_contests(contests, page, contests_per_page, is_admin)
-
-    update_time = datetime.now().strftime("%d.%m %H:%M")
-    message = f"Активные конкурсы:\n\n{message}\n\nДанные обновлены: {update_time}"
-
-    keyboard = [
-        [InlineKeyboardButton("⬅️", callback_data=f'page_Активен_{page - 1}'),
-         InlineKeyboardButton(f"{page}/{total_pages}", callback_data='current_page'),
-         InlineKeyboardButton("➡️", callback_data=f'page_Активен_{page + 1}')],
-        [InlineKeyboardButton("🏆 Активные", callback_data='show_active'),
-         InlineKeyboardButton("🏁 Завершенные", callback_data='show_completed'),
-         InlineKeyboardButton("👀 Отслеживание", callback_data='show_tracked')]
-    ]
-
-    if is_admin:
-        keyboard.append([InlineKeyboardButton("📥 Показать ожидающие конкурсы", callback_data='show_pending_contests')])
-
-    keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data='refresh_Активен')])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    message, reply_markup = await render_contests_page(
+        'Активен', page, total_pages, contests, is_admin, show_pending=is_admin
+    )
 
     if update.callback_query:
-        await update.callback_query.edit_message_text(
-            text=message,
+        await edit_message_if_changed(
+            context.bot,
+            update.callback_query.message.chat_id,
+            update.callback_query.message.message_id,
+            message,
+            reply_markup=reply_markup,
             parse_mode=ParseMode.HTML,
-            disable_web_page_preview=True,
-            reply_markup=reply_markup
+            disable_web_page_preview=True
         )
     elif update.message:
         await update.message.reply_text(
@@ -1000,23 +2676,89 @@ async def show_contests(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup
         )
 
-    context.user_data['contests'] = contests
-    context.user_data['total_pages'] = total_pages
-    context.user_data['current_status'] = 'Активен'
+    context.user_data['contests_cursor'] = make_contests_cursor('Активен', page, contests)
 
     return WAITING_INPUT
 
 
-# Новая функция для пагинации
-async def get_paginated_contests(contests, page, contests_per_page, is_admin):
-    start = (page - 1) * contests_per_page
-    end = start + contests_per_page
+# Статичные строки клавиатуры списка конкурсов, создаются один раз
+CONTEST_TYPE_ROW = (
+    InlineKeyboardButton("🏆 Активные", callback_data='show_active'),
+    InlineKeyboardButton("🏁 Завершенные", callback_data='show_completed'),
+    InlineKeyboardButton("👀 Отслеживание", callback_data='show_tracked'),
+)
+PENDING_CONTESTS_ROW = (
+    InlineKeyboardButton("📥 Показать ожидающие конкурсы", callback_data='show_pending_contests'),
+)
+REFRESH_ROWS = {
+    status: (InlineKeyboardButton("🔄 Обновить", callback_data=f'refresh_{status}'),
+             InlineKeyboardButton("🔍 Поиск", callback_data='search'))
+    for status in CONTEST_LIST_FILTERS
+}
+SEARCH_ROW = (InlineKeyboardButton("🔍 Новый поиск", callback_data='search'),)
+EMPTY_CONTESTS_MARKUPS = {
+    status: InlineKeyboardMarkup((CONTEST_TYPE_ROW, REFRESH_ROWS[status]))
+    for status in CONTEST_LIST_FILTERS
+}
+CONTEST_LIST_TITLES = {
+    'Активен': "Активные конкурсы",
+    'Завершен': "Завершенные конкурсы за сегодня",
+}
 
-    paginated_contests = contests[start:end]
+# Кэш отрисованных страниц: (status, page, is_admin, show_pending, версия данных) -> (строки, страниц, текст, клавиатура).
+# Время «Данные обновлены» в кэш не входит и дописывается при каждом показе
+RENDERED_PAGES_MAXSIZE = 1024
+rendered_pages = OrderedDict()
+rendered_pages_version = contests_cache.version
+
+
+# Функция для отрисовки страницы списка конкурсов (текст и клавиатура) с кэшированием
+async def render_contests_page(status, page, total_pages, contests, is_admin, show_pending=False):
+    global rendered_pages_version
+    if rendered_pages_version != contests_cache.version:
+        rendered_pages.clear()
+        rendered_pages_version = contests_cache.version
+
+    key = (status, page, is_admin, show_pending, contests_cache.version)
+    entry = rendered_pages.get(key)
+    # Страница действительна, пока кэш списков отдает тот же набор строк
+    if entry is not None and entry[0] is contests and entry[1] == total_pages:
+        rendered_pages.move_to_end(key)
+        return with_update_time(entry[2]), entry[3]
+
+    body = await get_paginated_contests(contests, is_admin)
+    title = CONTEST_LIST_TITLES[status]
+    if status == 'Активен' and ACTIVE_LOOKBACK_MONTHS is not None:
+        title += f" с {get_active_since(date.today()).strftime('%d.%m.%Y')} (более ранние скрыты)"
+    message = f"{title}:\n\n{body}"
 
+    keyboard = [
+        (InlineKeyboardButton("⬅️", callback_data=f'page_{status}_{page - 1}'),
+         InlineKeyboardButton(f"{page}/{total_pages}", callback_data='current_page'),
+         InlineKeyboardButton("➡️", callback_data=f'page_{status}_{page + 1}')),
+        CONTEST_TYPE_ROW,
+    ]
+    if show_pending:
+        keyboard.append(PENDING_CONTESTS_ROW)
+    keyboard.append(REFRESH_ROWS[status])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    rendered_pages[key] = (contests, total_pages, message, reply_markup)
+    while len(rendered_pages) > RENDERED_PAGES_MAXSIZE:
+        rendered_pages.popitem(last=False)
+    return with_update_time(message), reply_markup
+
+
+# Функция для добавления к тексту страницы времени показа
+def with_update_time(message):
+    return f"{message}\n\nДанные обновлены: {datetime.now().strftime('%d.%m %H:%M')}"
+
+
+# Новая функция для пагинации: формирует текст уже выбранной страницы
+async def get_paginated_contests(contests, is_admin):
     message = ""
-    for contest in paginated_contests:
-        message += f"Дата: {contest['date']}\n"
+    for contest in contests:
+        message += f"Дата: {format_date(contest['date'])}\n"
         message += f"Ссылка: <a href=\"{contest['link']}\">{contest['link']}</a>\n"
         if is_admin:
             message += f"Количество участников: {contest.get('participant_count', 'Н/Д')}\n"
@@ -1039,57 +2781,31 @@ async def handle_pagination(update, context):
 
 async def update_contests_page(update, context, page, status='Активен'):
     is_admin = await check_admin_status(update.effective_user.id, context)
+    chat_id = update.callback_query.message.chat_id
+    message_id = update.callback_query.message.message_id
 
-    contests = await get_contests_message(status, is_admin)
+    contests, total_pages, page = await get_contests_message(
+        status, page, context.user_data.get('contests_cursor')
+    )
 
     if not contests:
         message = "На данный момент нет активных конкурсов." if status == 'Активен' else "На сегодня нет завершенных конкурсов."
-        keyboard = [
-            [InlineKeyboardButton("🏆 Активные", callback_data='show_active'),
-             InlineKeyboardButton("🏁 Завершенные", callback_data='show_completed'),
-             InlineKeyboardButton("👀 Отслеживание", callback_data='show_tracked')],
-            [InlineKeyboardButton("🔄 Обновить", callback_data=f'refresh_{status}')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.callback_query.edit_message_text(text=message, reply_markup=reply_markup)
+        await edit_message_if_changed(
+            context.bot, chat_id, message_id, message, reply_markup=EMPTY_CONTESTS_MARKUPS[status]
+        )
         return WAITING_INPUT
 
-    contests_per_page = 5
-    total_pages = ceil(len(contests) / contests_per_page)
-
-    page = max(1, min(page, total_pages))
-
-    message = await get_paginated_contests(contests, page, contests_per_page, is_admin)
-
-    update_time = datetime.now().strftime("%d.%m %H:%M")
-    status_text = "Активные конкурсы" if status == 'Активен' else "Завершенные конкурсы за сегодня"
-    message = f"{status_text}:\n\n{message}\n\nДанные обновлены: {update_time}"
-
-    keyboard = [
-        [InlineKeyboardButton("⬅️", callback_data=f'page_{status}_{page - 1}'),
-         InlineKeyboardButton(f"{page}/{total_pages}", callback_data='current_page'),
-         InlineKeyboardButton("➡️", callback_data=f'page_{status}_{page + 1}')],
-        [InlineKeyboardButton("🏆 Активные", callback_data='show_active'),
-         InlineKeyboardButton("🏁 Завершенные", callback_data='show_completed'),
-         InlineKeyboardButton("👀 Отслеживание", callback_data='show_tracked')],
-        [InlineKeyboardButton("🔄 Обновить", callback_data=f'refresh_{status}')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    message, reply_markup = await render_contests_page(status, page, total_pages, contests, is_admin)
 
-    try:
-        await update.callback_query.edit_message_text(
-            text=message,
-            parse_mode=ParseMode.HTML,
-            disable_web_page_preview=True,
-            reply_markup=reply_markup
-        )
-    except telegram.error.BadRequest as e:
-        if "Message is not modified" not in str(e):
-            raise e
+    # Неизменившаяся страница (частый случай для 🔄) не отправляется в Bot API повторно
+    await edit_message_if_changed(
+        context.bot, chat_id, message_id, message,
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True
+    )
 
-    context.user_data['contests'] = contests
-    context.user_data['total_pages'] = total_pages
-    context.user_data['current_status'] = status
+    context.user_data['contests_cursor'] = make_contests_cursor(status, page, contests)
 
 async def handle_pagination(update, context):
     query = update.callback_query
@@ -1138,13 +2854,7 @@ async def switch_contest_type(update, context):
 
     # Удаляем сообщение о добавлении конкурса в отслеживаемые
     if 'tracked_added_message_id' in context.user_data:
-        try:
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=context.user_data['tracked_added_message_id']
-            )
-        except Exception as e:
-            print(f"Не удалось удалить сообщение о добавлении в отслеживаемые: {e}")
+        schedule_message_deletion(update.effective_chat.id, context.user_data['tracked_added_message_id'])
         del context.user_data['tracked_added_message_id']
 
     is_admin = update.effective_user.id in ADMIN_USERS
@@ -1176,14 +2886,14 @@ async def handle_pending_date_input(update: Update, context: ContextTypes.DEFAUL
             'link': context.user_data['link'],
             'date': process_date(date_text)
         }
-        await update.message.delete()
+        schedule_message_deletion(update.effective_chat.id, update.message.message_id)
         return await ask_for_pending_dop_channels(update, context)
     else:
         await update_or_send_message(
             update, context,
             f"Добавление конкурса в список ожидающих:\n\nСсылка: {context.user_data['link']}\n\nНеверный формат даты. Пожалуйста, введите дату в формате ДД.ММ."
         )
-        await update.message.delete()
+        schedule_message_deletion(update.effective_chat.id, update.message.message_id)
         return WAITING_FOR_PENDING_DATE
 
 
@@ -1231,7 +2941,7 @@ async def handle_pending_dop_channels_input(update: Update, context: ContextType
 
     del context.user_data['waiting_for_pending_dop_channels']
 
-    await update.message.delete()
+    schedule_message_deletion(update.effective_chat.id, update.message.message_id)
     return await save_pending_contest(update, context)
 
 
@@ -1243,7 +2953,7 @@ async def save_pending_contest(update: Update, context: ContextTypes.DEFAULT_TYP
     logging.info(f"Attempting to save pending contest: {pending_contest}")
 
     if 'link' in pending_contest and 'date' in pending_contest and not user_data.get('contest_saved', False):
-        query = "INSERT INTO contests.pending_contests (link, date, dop_channels) VALUES ($1, $2, $3)"
+        query = "INSERT INTO contests.pending_contests (link, link_key, date, dop_channels) VALUES ($1, $2, $3, $4)"
 
         dop_channels = pending_contest.get('dop_channels', 'false')
         if isinstance(dop_channels, str):
@@ -1251,17 +2961,17 @@ async def save_pending_contest(update: Update, context: ContextTypes.DEFAULT_TYP
             if dop_channels.lower() == 'false':
                 dop_channels = False
 
-        params = [
-            pending_contest['link'],
-            pending_contest['date'],
-            dop_channels
-        ]
-
         logging.info(f"SQL Query: {query}")
-        logging.info(f"Params: {params}")
 
         try:
-            await execute_query(query, params)
+            params = [
+                pending_contest['link'],
+                canonicalize_link(pending_contest['link']),
+                to_db_date(pending_contest['date']),
+                dop_channels
+            ]
+            logging.info(f"Params: {params}")
+            await execute_query(query, params, name="add_pending_contest")
 
             success_message = (
                 "Конкурс добавлен в список ожидающих:\n\n"
@@ -1293,35 +3003,177 @@ async def save_pending_contest(update: Update, context: ContextTypes.DEFAULT_TYP
     return WAITING_INPUT
 
 
-# Функция для отображения списка ожидающих конкурсов
-async def show_pending_contests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Функция для формирования списка ожидающих конкурсов с выбором для переноса
+def render_pending_contests(pending_contests, selection, header=None):
+    message = f"{header}\n\n" if header else ""
+    if not pending_contests:
+        message += "У вас нет ожидающих конкурсов."
+    else:
+        message += "Ожидающие конкурсы:\n\n"
+        for i, contest in enumerate(pending_contests, 1):
+            link = contest.get('link', 'Ссылка отсутствует')
+            date = format_date(contest.get('date')) or 'Дата не указана'
+            message += f"{i}. <a href='{link}'>{link}</a>\nДата: {date}\n\n"
+
+    keyboard = []
+    for i, contest in enumerate(pending_contests, 1):
+        mark = "✅" if contest['id'] in selection else "⬜"
+        keyboard.append([
+            InlineKeyboardButton(f"{mark} {i}. {contest['link']}", callback_data=encode_callback('pnd_sel', contest['id'])),
+            InlineKeyboardButton("⬆️", callback_data=encode_callback('pnd_mv', contest['id'])),
+        ])
+    if pending_contests:
+        keyboard.append([
+            InlineKeyboardButton(f"⬆️ Перенести выбранные ({len(selection)})", callback_data='transfer_selected'),
+            InlineKeyboardButton("⬆️ Перенести все", callback_data='transfer_all'),
+        ])
+    keyboard.append(list(CONTEST_TYPE_ROW))
+    keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data='refresh_pending')])
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+# Функция для получения шаблона ILIKE с экранированными спецсимволами
+def make_search_pattern(text):
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+# Функция для поиска конкурсов по подстроке ссылки или доп. каналов: (конкурсы, всего страниц, номер страницы)
+async def search_contests(text, page=1):
+    pattern = make_search_pattern(text)
+    use_primary = contests_recently_written()
+
+    async def load_count():
+        count = await fetch_prepared("search_count", pattern, use_primary=use_primary)
+        return count[0]['count']
+
+    count = await search_cache.get_or_load(('count', pattern), load_count)
+    total_pages = ceil(count / CONTESTS_PER_PAGE)
+    if not total_pages:
+        return [], 0, 1
+
+    page = max(1, min(page, total_pages))
+
+    async def load_page():
+        return await fetch_prepared(
+            "search_page", pattern, CONTESTS_PER_PAGE, (page - 1) * CONTESTS_PER_PAGE, use_primary=use_primary
+        )
+
+    contests = await search_cache.get_or_load(('page', pattern, page), load_page)
+    return contests, total_pages, page
+
+
+# Функция для отрисовки страницы результатов поиска (текст и клавиатура)
+async def render_search_results(text, page, total_pages, contests, is_admin):
+    query_text = html.escape(text)
+    if not contests:
+        message = f"По запросу «{query_text}» ничего не найдено."
+        return message, InlineKeyboardMarkup((CONTEST_TYPE_ROW, SEARCH_ROW))
+
+    body = await get_paginated_contests(contests, is_admin)
+    message = f"Результаты поиска «{query_text}»:\n\n{body}"
+    keyboard = (
+        (InlineKeyboardButton("⬅️", callback_data=f'search_page_{page - 1}'),
+         InlineKeyboardButton(f"{page}/{total_pages}", callback_data='current_page'),
+         InlineKeyboardButton("➡️", callback_data=f'search_page_{page + 1}')),
+        CONTEST_TYPE_ROW,
+        SEARCH_ROW,
+    )
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+# Функция для выполнения поиска и показа страницы результатов
+async def run_search(update, context, text, page=1):
+    text = text.strip()[:SEARCH_PARAMS["max_length"]]
+    if len(text) < SEARCH_PARAMS["min_length"]:
+        context.user_data['waiting_for_search'] = True
+        await update_or_send_message(
+            update, context,
+            f"Введите не меньше {SEARCH_PARAMS['min_length']} символов для поиска."
+        )
+        return WAITING_INPUT
+
+    context.user_data['search_query'] = text
+    is_admin = await check_admin_status(update.effective_user.id, context)
+    contests, total_pages, page = await search_contests(text, page)
+    message, reply_markup = await render_search_results(text, page, total_pages, contests, is_admin)
+
+    if update.callback_query:
+        await edit_message_if_changed(
+            context.bot,
+            update.callback_query.message.chat_id,
+            update.callback_query.message.message_id,
+            message,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True
+        )
+    else:
+        await update.message.reply_text(
+            message,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+            reply_markup=reply_markup
+        )
+    return WAITING_INPUT
+
+
+# Обработчик команды /search [текст] и кнопки «Поиск»: без текста запрашивает его у пользователя
+async def start_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        await update.callback_query.answer()
+    elif context.args:
+        return await run_search(update, context, " ".join(context.args))
+    return await prompt_search_query(update, context)
+
+
+# Функция для запроса текста поиска; callback к этому моменту уже должен быть отвечен
+async def prompt_search_query(update, context):
+    context.user_data['waiting_for_search'] = True
+    prompt = "Введите часть ссылки или название канала для поиска:"
+    if update.callback_query:
+        await update.callback_query.edit_message_text(prompt)
+    else:
+        await update.message.reply_text(prompt)
+    return WAITING_INPUT
+
+
+# Обработчик текста поиска, введенного после /search или кнопки «Поиск»
+async def handle_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop('waiting_for_search', None)
+    schedule_message_deletion(update.effective_chat.id, update.message.message_id)
+    return await run_search(update, context, update.message.text)
+
+
+# Обработчик переключения страниц результатов поиска
+async def handle_search_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    user_id = update.effective_user.id
-    pending_contests = await get_pending_contests(user_id)
+    text = context.user_data.get('search_query')
+    if not text:
+        return await prompt_search_query(update, context)
 
-    if not pending_contests:
-        message = "У вас нет ожидающих конкурсов."
-    else:
-        message = "Ожидающие конкурсы:\n\n"
-        for contest in pending_contests:
-            link = contest.get('link', 'Ссылка отсутствует')
-            date = contest.get('date', 'Дата не указана')
-            message += f"<a href='{link}'>{link}</a>\nДата: {date}\n\n"
+    page = int(query.data.rsplit('_', 1)[1])
+    return await run_search(update, context, text, page)
 
-    keyboard = [
-        [InlineKeyboardButton("🏆 Активные", callback_data='show_active'),
-         InlineKeyboardButton("🏁 Завершенные", callback_data='show_completed'),
-         InlineKeyboardButton("👀 Отслеживаемые", callback_data='show_tracked')],
-        [InlineKeyboardButton("🔄 Обновить", callback_data='refresh_pending')]
-    ]
 
-    is_admin = user_id in ADMIN_USERS
-    keyboard = add_admin_buttons(keyboard, is_admin)
+# Функция для отображения списка ожидающих конкурсов
+async def show_pending_contests(update: Update, context: ContextTypes.DEFAULT_TYPE, header=None):
+    query = update.callback_query
+    await query.answer()
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if update.effective_user.id not in ADMIN_USERS:
+        await query.edit_message_text("У вас недостаточно прав для выполнения этой операции.", disable_web_page_preview=True)
+        return WAITING_INPUT
+
+    pending_contests = await get_pending_contests()
+    # Выбор сбрасывается для строк, которых больше нет в списке
+    pending_ids = {contest['id'] for contest in pending_contests}
+    selection = [contest_id for contest_id in context.user_data.get('pending_selection', []) if contest_id in pending_ids]
+    context.user_data['pending_selection'] = selection
 
+    message, reply_markup = render_pending_contests(pending_contests, selection, header)
     await query.edit_message_text(
         text=message,
         reply_markup=reply_markup,
@@ -1332,51 +3184,223 @@ async def show_pending_contests(update: Update, context: ContextTypes.DEFAULT_TY
     return WAITING_INPUT
 
 
+# Функция для отметки ожидающего конкурса для группового переноса
+async def toggle_pending_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _, (contest_id,) = decode_callback(update.callback_query.data)
+    selection = context.user_data.setdefault('pending_selection', [])
+    if contest_id in selection:
+        selection.remove(contest_id)
+    else:
+        selection.append(contest_id)
+    return await show_pending_contests(update, context)
+
+
 # Функция для получения списка ожидающих конкурсов
 async def get_pending_contests():
-    query = "SELECT link FROM contests.pending_contests"
-    return await execute_query(query)
+    return await fetch_prepared("pending_contests")
+
+
+# Функция для переноса ожидающих конкурсов в основную таблицу одним запросом.
+# contest_ids=None переносит все ожидающие конкурсы. Конкурсы, чей link_key уже есть в основной
+# таблице (или повторяется среди переносимых), удаляются из ожидающих без добавления.
+# Возвращает (перенесенные ссылки, число пропущенных дубликатов)
+async def move_pending_contests(contest_ids=None):
+    where = "" if contest_ids is None else "WHERE id = ANY($1::bigint[])"
+    query = f"""
+        WITH moved AS (
+            DELETE FROM contests.pending_contests
+            {where}
+            RETURNING link, COALESCE(link_key, link) AS link_key, date, dop_channels
+        ), inserted AS (
+            INSERT INTO contests.contests (link, link_key, date, dop_channels, status)
+            SELECT DISTINCT ON (m.link_key) m.link, m.link_key, m.date, m.dop_channels, 'Активен'
+            FROM moved m
+            WHERE NOT EXISTS (SELECT 1 FROM contests.contests c WHERE c.link_key = m.link_key)
+            ORDER BY m.link_key
+            RETURNING link
+        )
+        SELECT (SELECT COALESCE(array_agg(link), '{{}}') FROM inserted) AS moved,
+               (SELECT count(*) FROM moved) - (SELECT count(*) FROM inserted) AS skipped
+    """
+    result = await execute_query(query, None if contest_ids is None else (list(contest_ids),), name="move_pending_contests")
+    moved, skipped = list(result[0]['moved']), result[0]['skipped']
+    if moved:
+        invalidate_contests_cache()
+    return moved, skipped
 
 
-# Функция для переноса конкурса в основную таблицу
+# Функция для переноса одного, выбранных или всех ожидающих конкурсов в основную таблицу
 async def transfer_to_main_db(update, context):
     query = update.callback_query
-    await query.answer()
 
     if update.effective_user.id not in ADMIN_USERS:
+        await query.answer()
         await query.edit_message_text("У вас недостаточно прав для выполнения этой операции.", disable_web_page_preview=True)
         return WAITING_INPUT
 
-    contest_index = int(query.data.split('_')[-1]) - 1
-    pending_contests = await get_pending_contests()
+    if query.data == 'transfer_all':
+        moved, skipped = await move_pending_contests()
+    else:
+        if query.data == 'transfer_selected':
+            contest_ids = context.user_data.get('pending_selection', [])
+        else:
+            _, contest_ids = decode_callback(query.data)
+        if not contest_ids:
+            await query.answer("Не выбрано ни одного конкурса.")
+            return WAITING_INPUT
 
-    if 0 <= contest_index < len(pending_contests):
-        link = pending_contests[contest_index]['link']
+        moved, skipped = await move_pending_contests(contest_ids)
 
-        # Получаем данные о конкурсе из таблицы pending_contests
-        get_pending_contest_query = "SELECT * FROM contests.pending_contests WHERE link = $1"
-        pending_contest_data = await execute_query(get_pending_contest_query, (link,))
+    context.user_data['pending_selection'] = []
+    if moved or skipped:
+        header = f"Перенесено в основную базу данных: {len(moved)}"
+        if skipped:
+            header += f"\nУже были в основной базе (удалены из ожидающих): {skipped}"
+    else:
+        header = "Не удалось найти выбранные конкурсы в таблице ожидающих конкурсов."
+    return await show_pending_contests(update, context, header)
 
-        if pending_contest_data:
-            # Добавляем конкурс в основную таблицу
-            add_query = """
-            INSERT INTO contests.contests (link, date, dop_channels, status)
-            VALUES ($1, $2, $3, 'Активен')
-            """
-            await execute_query(add_query, (link, pending_contest_data[0]['date'], pending_contest_data[0]['dop_channels']))
+# Функция для проверки даты из файла загрузки (ДД.ММ или ДД.ММ.ГГГГ), возвращает date
+def parse_import_date(date_text):
+    if is_date(date_text):
+        return to_db_date(process_date(date_text))
+    return to_db_date(date_text)
 
-            # Удаляем конкурс из таблицы pending_contests
-            delete_query = "DELETE FROM contests.pending_contests WHERE link = $1"
-            await execute_query(delete_query, (link,))
 
-            await query.edit_message_text(f"Конкурс {link} перенесен в основную базу данных.", disable_web_page_preview=True)
-        else:
-            await query.edit_message_text("Не удалось найти данные о конкурсе в таблице ожидающих конкурсов.", disable_web_page_preview=True)
+# Функция для декодирования файла загрузки первой подходящей кодировкой из IMPORT_PARAMS
+def decode_import_file(data):
+    *fallbacks, last = IMPORT_PARAMS["encodings"]
+    for encoding in fallbacks:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode(last)
+
+
+# Функция для разбора файла загрузки за один проход: (записи, дубликаты в файле, ошибки).
+# Нечитаемый файл целиком приводит к UnicodeDecodeError или csv.Error
+def parse_contests_file(data, delimiter):
+    records = []
+    seen_keys = set()
+    duplicates = 0
+    errors = []
+    reader = csv.reader(io.StringIO(decode_import_file(data), newline=''), delimiter=delimiter)
+    for line_number, row in enumerate(reader, 1):
+        row = [cell.strip() for cell in row]
+        if not any(row):
+            continue
+        if line_number == 1 and row[0].lower() == 'link':
+            continue
+        if len(row) < 2:
+            errors.append(f"строка {line_number}: ожидается link{delimiter}date[{delimiter}dop_channels]")
+            continue
+
+        link, date_text = row[0], row[1]
+        dop_channels = row[2] if len(row) > 2 and row[2] else 'false'
+        if not is_url(link):
+            errors.append(f"строка {line_number}: некорректная ссылка {link}")
+            continue
+        link = prepare_link(link)
+        link_key = canonicalize_link(link)
+        try:
+            contest_date = parse_import_date(date_text)
+        except ValueError:
+            errors.append(f"строка {line_number}: некорректная дата {date_text}")
+            continue
+        if link_key in seen_keys:
+            duplicates += 1
+            continue
+        seen_keys.add(link_key)
+        records.append((link, link_key, contest_date, dop_channels))
+    return records, duplicates, errors
+
+
+# Функция для загрузки проверенных записей через COPY одной транзакцией, возвращает число добавленных
+async def import_contests(records, pending=False):
+    if pending:
+        insert_query = """
+            INSERT INTO contests.pending_contests (link, link_key, date, dop_channels)
+            SELECT i.link, i.link_key, i.date, i.dop_channels FROM contests_import i
+            WHERE NOT EXISTS (SELECT 1 FROM contests.pending_contests p WHERE p.link_key = i.link_key)
+            RETURNING link
+        """
     else:
-        await query.edit_message_text("Произошла ошибка. Пожалуйста, попробуйте снова.", disable_web_page_preview=True)
+        insert_query = """
+            INSERT INTO contests.contests (link, link_key, date, dop_channels, status)
+            SELECT i.link, i.link_key, i.date, i.dop_channels, 'Активен' FROM contests_import i
+            WHERE NOT EXISTS (SELECT 1 FROM contests.contests c WHERE c.link_key = i.link_key)
+            RETURNING link
+        """
+
+    async with observe_query("import_contests"), acquire_connection() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "CREATE TEMP TABLE contests_import (link text, link_key text, date date, dop_channels text) ON COMMIT DROP"
+            )
+            await conn.copy_records_to_table(
+                'contests_import', records=records, columns=['link', 'link_key', 'date', 'dop_channels']
+            )
+            inserted = await conn.fetch(insert_query)
+
+    if not pending:
+        invalidate_contests_cache()
+    return len(inserted)
+
 
+# Обработчик загруженного администратором файла с конкурсами (CSV/TSV: link;date;dop_channels).
+# Подпись "ожидающие" или "pending" загружает файл в список ожидающих конкурсов
+async def handle_contests_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("У вас недостаточно прав для загрузки конкурсов.")
+        return WAITING_INPUT
+
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_PARAMS["max_file_size"]:
+        await update.message.reply_text("Файл слишком большой.")
+        return WAITING_INPUT
+
+    caption = (update.message.caption or '').strip().lower()
+    pending = caption in ('ожидающие', 'pending')
+    delimiter = '\t' if (document.file_name or '').lower().endswith('.tsv') else ';'
+
+    telegram_file = await document.get_file()
+    data = bytes(await telegram_file.download_as_bytearray())
+    try:
+        records, duplicates, errors = parse_contests_file(data, delimiter)
+    except (UnicodeDecodeError, csv.Error) as e:
+        logging.warning(f"Unreadable contests file {document.file_name}: {e}")
+        await update.message.reply_text(
+            f"Не удалось прочитать файл: {e}. Сохраните его в UTF-8 или Windows-1251. Ничего не добавлено."
+        )
+        return WAITING_INPUT
+
+    inserted = 0
+    if records:
+        try:
+            inserted = await import_contests(records, pending)
+        except Exception as e:
+            logging.error(f"Error importing contests: {e}", exc_info=True)
+            await update.message.reply_text(f"Ошибка при загрузке конкурсов: {e}. Ничего не добавлено.")
+            return WAITING_INPUT
+
+    target = "ожидающие конкурсы" if pending else "конкурсы"
+    skipped = duplicates + len(records) - inserted
+    summary = (
+        f"Загрузка в {target} завершена.\n\n"
+        f"Добавлено: {inserted}\n"
+        f"Пропущено дубликатов: {skipped}\n"
+        f"Ошибок: {len(errors)}"
+    )
+    if errors:
+        summary += "\n\n" + "\n".join(errors[:IMPORT_PARAMS["max_reported_errors"]])
+        if len(errors) > IMPORT_PARAMS["max_reported_errors"]:
+            summary += f"\n... и еще {len(errors) - IMPORT_PARAMS['max_reported_errors']}"
+
+    await update.message.reply_text(summary, disable_web_page_preview=True)
     return WAITING_INPUT
 
+
 async def handle_add_later(update, context):
     query = update.callback_query
     user_data = context.user_data
@@ -1407,13 +3431,174 @@ def end_conversation(update, context):
     update.message.reply_text('Thank you, your contest has been saved.')
     return ConversationHandler.END
 
+# Периодическое обслуживание разделов: будущие месяцы создаются заранее,
+# старые разделы отсоединяются, если задан PARTITION_PARAMS["detach_after_months"]
+async def maintain_contest_partitions(context: ContextTypes.DEFAULT_TYPE):
+    await execute_query(
+        "SELECT contests.ensure_contest_partitions(current_date, $1)",
+        (PARTITION_PARAMS["months_ahead"],),
+        name="ensure_contest_partitions"
+    )
+    if PARTITION_PARAMS["detach_after_months"] is None:
+        return
+    detached = await execute_query(
+        "SELECT contests.detach_old_contest_partitions($1) AS partition_name",
+        (PARTITION_PARAMS["detach_after_months"],),
+        name="detach_contest_partitions"
+    )
+    if detached:
+        logger.info(f"Detached contest partitions: {', '.join(row['partition_name'] for row in detached)}")
+        invalidate_contests_cache()
+
+
+# Время последней активности пользователей: {user_id: time.time()}
+user_last_seen = {}
+
+
+# Отметка активности пользователя, вызывается до остальных обработчиков
+async def track_user_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user:
+        user_last_seen[update.effective_user.id] = time.time()
+
+
+# Периодическое удаление user_data пользователей, неактивных дольше idle_ttl
+async def evict_idle_user_data(context: ContextTypes.DEFAULT_TYPE):
+    now = time.time()
+    deadline = now - USER_DATA_PARAMS["idle_ttl"]
+    idle_users = []
+    for user_id in list(context.application.user_data):
+        # Для восстановленных после перезапуска пользователей отсчет начинается заново
+        if user_last_seen.setdefault(user_id, now) < deadline:
+            idle_users.append(user_id)
+
+    for user_id in idle_users:
+        context.application.drop_user_data(user_id)
+        del user_last_seen[user_id]
+
+    if idle_users:
+        logger.info(f"Evicted user_data of {len(idle_users)} idle users")
+
+
+# Создание пула соединений и подготовка схемы при запуске приложения
+async def post_init(application):
+    global cleanup_wakeup, cleanup_task
+    start_http_server(METRICS_PARAMS["port"], addr=METRICS_PARAMS["host"])
+    logger.info(f"Metrics endpoint listening on {METRICS_PARAMS['host']}:{METRICS_PARAMS['port']}")
+    await get_db_pool()
+    await schedule_next_reminder(application)
+    cleanup_wakeup = asyncio.Event()
+    cleanup_task = asyncio.create_task(message_cleanup_loop(application.bot))
+
+
+# Закрытие пула соединений при остановке приложения
+async def post_shutdown(application):
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+        try:
+            await cleanup_task
+        except asyncio.CancelledError:
+            pass
+    # Несделанные удаления сохраняются и будут выполнены после перезапуска
+    await persist_message_deletions(pending_deletions)
+    await close_db_pool()
+
+
+# Обработчик входящих обновлений webhook: проверка секрета и постановка в очередь
+async def handle_webhook_request(request):
+    application = request.app['application']
+
+    secret_token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    # Сравнение байтов: compare_digest не принимает строки с не-ASCII символами
+    if not hmac.compare_digest(secret_token.encode(), WEBHOOK_PARAMS["secret_token"].encode()):
+        logger.warning(f"Webhook request with invalid secret token from {request.remote}")
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+        if not isinstance(data, dict):
+            raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+        update = Update.de_json(data, application.bot)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Malformed webhook request from {request.remote}: {e}")
+        return web.Response(status=400)
+
+    # Ответ отдается сразу после постановки в очередь, обработка идет в приложении
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+# Запуск бота в режиме webhook на локальном HTTP-сервере
+async def run_webhook(application):
+    if not WEBHOOK_PARAMS["secret_token"]:
+        if not WEBHOOK_PARAMS["webhook_url"]:
+            raise RuntimeError("WEBHOOK_PARAMS['secret_token'] не задан: без него webhook принимал бы запросы от кого угодно")
+        # Бот сам передает секрет в setWebhook, поэтому случайного на время работы процесса достаточно
+        WEBHOOK_PARAMS["secret_token"] = secrets.token_urlsafe(32)
+        logger.warning("Webhook secret_token is not configured, using a random one for this run")
+
+    web_app = web.Application()
+    web_app['application'] = application
+    web_app.router.add_post(f"/{WEBHOOK_PARAMS['url_path']}", handle_webhook_request)
+    runner = web.AppRunner(web_app)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        await post_init(application)
+        # Переключение с polling: после setWebhook Telegram перестает отдавать getUpdates.
+        # Обратно run_polling сам удаляет webhook, накопленные обновления не теряются
+        if WEBHOOK_PARAMS["webhook_url"]:
+            await application.bot.set_webhook(
+                url=WEBHOOK_PARAMS["webhook_url"],
+                secret_token=WEBHOOK_PARAMS["secret_token"],
+                max_connections=WEBHOOK_PARAMS["max_connections"],
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        await runner.setup()
+        site = web.TCPSite(runner, WEBHOOK_PARAMS["listen"], WEBHOOK_PARAMS["port"])
+        await site.start()
+        logger.info(f"Webhook server listening on {WEBHOOK_PARAMS['listen']}:{WEBHOOK_PARAMS['port']}/{WEBHOOK_PARAMS['url_path']}")
+
+        try:
+            await stop_event.wait()
+        finally:
+            # Сначала перестаем принимать запросы, затем дорабатываем очередь обновлений
+            await runner.cleanup()
+            await application.stop()
+    await post_shutdown(application)
+
+
 def main():
-    application = Application.builder().token("1").build()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    args = parser.parse_args()
+
+    application = (
+        Application.builder()
+        .token("1")
+        .concurrent_updates(PerUserUpdateProcessor(
+            CONCURRENCY_PARAMS["max_concurrent_updates"],
+            CONCURRENCY_PARAMS["max_queued_updates"],
+        ))
+        .persistence(PostgresPersistence(PERSISTENCE_PARAMS["flush_interval"], PERSISTENCE_PARAMS["retry_delay"]))
+        .rate_limiter(OutboundRateLimiter(OUTBOUND_PARAMS))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+        entry_points=[CommandHandler('start', start), CommandHandler('search', start_search)],
         states={
             WAITING_INPUT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_input),
+                MessageHandler(
+                    filters.Document.FileExtension("csv") | filters.Document.FileExtension("tsv"),
+                    handle_contests_import
+                ),
                 CallbackQueryHandler(handle_url_action, pattern='^(finish_contest|add_contest|track_contest|add_to_pending|cancel)$'),
                 CallbackQueryHandler(additional_channels, pattern='^(yes|no)$'),
                 CallbackQueryHandler(refresh_contests, pattern='^refresh_(Активен|Завершен)$'),
@@ -1422,12 +3607,15 @@ def main():
                 CallbackQueryHandler(show_contests, pattern='^show_all_contests$'),
                 CallbackQueryHandler(finish_contest, pattern='^finish_contest$'),
                 CallbackQueryHandler(delete_tracked_contest, pattern='^delete_tracked$'),
-                CallbackQueryHandler(handle_delete_tracked, pattern=r'^delete_\d+$'),
+                CallbackQueryHandler(handle_delete_tracked, pattern='^trk_del:[0-9a-z]+$'),
                 CallbackQueryHandler(handle_delete_tracked, pattern='^cancel_delete$'),
                 CallbackQueryHandler(add_new_tracked_contest, pattern='^add_tracked$'),
-                CallbackQueryHandler(show_pending_contests, pattern='^show_pending_contests$'),
-                CallbackQueryHandler(transfer_to_main_db, pattern='^transfer_to_main_db_'),
+                CallbackQueryHandler(show_pending_contests, pattern='^(show_pending_contests|refresh_pending)$'),
+                CallbackQueryHandler(toggle_pending_selection, pattern='^pnd_sel:[0-9a-z]+$'),
+                CallbackQueryHandler(transfer_to_main_db, pattern='^(pnd_mv:[0-9a-z,]+|transfer_selected|transfer_all)$'),
                 CallbackQueryHandler(handle_pending_dop_channels, pattern='^pending_(yes|no)$'),
+                CallbackQueryHandler(start_search, pattern='^search$'),
+                CallbackQueryHandler(handle_search_pagination, pattern=r'^search_page_\d+$'),
             ],
             WAITING_FOR_TRACKED_DATE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_tracked_date_input),
@@ -1458,11 +3646,29 @@ def main():
                  MessageHandler(filters.TEXT & ~filters.COMMAND, handle_pending_date_input)
             ]
         },
-        fallbacks=[CommandHandler('start', start)],
+        fallbacks=[CommandHandler('start', start), CommandHandler('search', start_search)],
+        name="main_conversation",
+        persistent=True,
     )
 
+    application.add_handler(TypeHandler(Update, track_user_activity), group=-1)
     application.add_handler(conv_handler)
-    application.run_polling()
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+    application.job_queue.run_repeating(
+        maintain_contest_partitions,
+        interval=PARTITION_PARAMS["maintenance_interval"],
+        first=0,
+    )
+    application.job_queue.run_repeating(
+        evict_idle_user_data,
+        interval=USER_DATA_PARAMS["eviction_interval"],
+        first=USER_DATA_PARAMS["eviction_interval"],
+    )
+    if args.mode == "webhook":
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()